@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Методы Database, которые изменяют данные. Выполняются в единственном потоке записи,
+# остальные методы - в пуле потоков чтения.
+WRITE_METHODS = frozenset({
+    'init_db',
+    'add_user',
+    'upsert_users',
+    'set_user_role',
+    'add_doctor_messages',
+    'claim_question',
+    'release_question',
+    'add_doctor',
+    'remove_doctor',
+    'set_admin_password',
+    'set_social_subscription',
+    'set_channel_member',
+    'set_channel_members',
+    'update_channel_members_if_unchanged',
+    'set_tts_file_id',
+    'touch_tts_file_id',
+    'delete_tts_file_id',
+    'set_persistent_data',
+    'delete_persistent_data',
+    'rebuild_search_index',
+    'clear_all_data',
+    'clear_database_completely',
+})
+
+# Методы, которые идут через групповую запись Database.group_writer: вместо блокирующего
+# вызова в потоке записи ставим операцию в очередь и ждем ее Future в event loop
+GROUP_COMMIT_METHODS = {
+    'add_question': 'submit_question',
+    'add_answer': 'submit_answer',
+}
+
+# Методы, которые отвечают из памяти без обращения к базе. Выполняются прямо в event loop.
+MEMORY_METHODS = frozenset({
+    'is_doctor',
+    'get_all_doctors',
+})
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+    
+    Повторяет набор методов Database, но каждый метод - корутина, которая выполняет
+    запрос в отдельном потоке и не блокирует event loop.
+    
+    После каждого вызова вызываются наблюдатели из observers: observer(name, seconds, error),
+    где seconds включает ожидание свободного потока.
+    """
+    
+    def __init__(self, database, reader_threads=4):
+        self.database = database
+        self.observers = []
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._read_executor = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='db-reader')
+    
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        
+        if name in GROUP_COMMIT_METHODS:
+            submit = getattr(self.database, GROUP_COMMIT_METHODS[name])
+            
+            async def call(*args, **kwargs):
+                return await asyncio.wrap_future(submit(*args, **kwargs))
+        elif name in MEMORY_METHODS:
+            async def call(*args, **kwargs):
+                return attr(*args, **kwargs)
+        else:
+            executor = self._write_executor if name in WRITE_METHODS else self._read_executor
+            
+            async def call(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(executor, functools.partial(attr, *args, **kwargs))
+        
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            if not self.observers:
+                return await call(*args, **kwargs)
+            started_at = time.perf_counter()
+            error = None
+            try:
+                return await call(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self._notify(name, time.perf_counter() - started_at, error)
+        
+        # Кэшируем обертку, чтобы не создавать ее при каждом обращении
+        setattr(self, name, method)
+        return method
+    
+    def _notify(self, name, seconds, error):
+        for observer in self.observers:
+            try:
+                observer(name, seconds, error)
+            except Exception as e:
+                logger.warning(f"Ошибка наблюдателя базы данных: {e}")
+    
+    async def close(self):
+        """Дождаться завершения запросов, остановить потоки и закрыть соединения"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_executor.shutdown, True)
+        await loop.run_in_executor(None, self._read_executor.shutdown, True)
+        self.database.close()
+        logger.info("Соединения с базой данных закрыты")
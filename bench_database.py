@@ -0,0 +1,309 @@
+"""Микробенчмарки database.py на синтетических данных.
+
+Генерирует базы разного размера (по числу вопросов) с реалистичным соотношением
+пациентов, врачей, ответов и копий вопросов у врачей, затем замеряет время методов
+Database и сохраняет результаты в JSON, чтобы сравнивать их между изменениями схемы,
+индексов и настроек соединений.
+    
+    python bench_database.py --sizes 10000,100000,1000000 --output bench_results.json
+    python bench_database.py --sizes 10000000 --data-dir /var/tmp/bench --iterations 5000
+
+Сгенерированные базы сохраняются в --data-dir и переиспользуются при следующих
+запусках (--regenerate - создать заново). Замеры идут на временной копии базы, которая
+удаляется после замеров, поэтому записи бенчмарка не меняют сохраненный набор и запуски
+остаются сравнимыми.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+
+DOCTORS = 20
+QUESTIONS_PER_PATIENT = 4     # в среднем вопросов на одного пациента
+ANSWER_RATIO = 0.6            # доля вопросов с ответом
+BATCH = 50000                 # строк на одну транзакцию при генерации
+
+QUESTION_TEXTS = [
+    "Boshim og'riyapti, nima qilishim kerak?",
+    "Belim og'riyapti, qaysi mashqlarni qilish mumkin?",
+    "MRT natijalarini ko'rib bera olasizmi?",
+    "Tizzam shishgan, qachon klinikaga kelishim kerak?",
+    "Bo'ynim qotib qoldi, massaj yordam beradimi?",
+]
+# Запросы для полнотекстового поиска: частое слово, редкое сочетание, префикс
+SEARCH_QUERIES = ["og'riyapti", "tizzam shishgan", "massaj", "MRT natija", "bel"]
+ANSWER_TEXT = "Ko'proq suv iching va dam oling. Agar og'riq davom etsa, klinikaga keling."
+
+
+def generate(db_file, questions, seed=1):
+    """Создать базу с questions вопросами и пропорциональным числом пациентов и ответов"""
+    rng = random.Random(seed)
+    patients = max(1, questions // QUESTIONS_PER_PATIENT)
+    database = Database(db_file)
+    started_at = datetime(2024, 1, 1)
+    span = 365 * 24 * 3600
+    
+    def timestamp(offset):
+        return (started_at + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    with database.transaction() as cursor:
+        cursor.executemany(
+            'INSERT INTO users (user_id, username, full_name, role, created_at) VALUES (?, ?, ?, ?, ?)',
+            ((900000 + i, f"doctor{i}", f"Shifokor {i}", 'doctor', timestamp(i)) for i in range(DOCTORS))
+        )
+    for start in range(0, patients, BATCH):
+        with database.transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO users (user_id, username, full_name, role, created_at) VALUES (?, ?, ?, ?, ?)',
+                ((1000000 + i, f"user{i}", f"Bemor {i}", 'user', timestamp(rng.randrange(span)))
+                 for i in range(start, min(start + BATCH, patients)))
+            )
+            cursor.executemany(
+                'INSERT INTO channel_members (user_id, status) VALUES (?, ?)',
+                ((1000000 + i, 'member') for i in range(start, min(start + BATCH, patients)))
+            )
+    
+    message_id = 0
+    for start in range(0, questions, BATCH):
+        question_rows = []
+        answer_rows = []
+        copy_rows = []
+        for question_id in range(start + 1, min(start + BATCH, questions) + 1):
+            created = rng.randrange(span)
+            answered = rng.random() < ANSWER_RATIO
+            message_id += 1
+            question_rows.append((
+                question_id, 1000000 + rng.randrange(patients), message_id,
+                rng.choice(QUESTION_TEXTS), 'answered' if answered else 'pending', timestamp(created)
+            ))
+            doctor = rng.randrange(DOCTORS)
+            copy_rows.append((900000 + doctor, question_id, question_id))
+            if answered:
+                answer_rows.append((
+                    question_id, 900000 + doctor, message_id, ANSWER_TEXT,
+                    timestamp(created + rng.randrange(1, 48 * 3600))
+                ))
+        with database.transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO questions (question_id, user_id, message_id, question_text, status, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', question_rows
+            )
+            cursor.executemany(
+                'INSERT INTO answers (question_id, doctor_id, message_id, answer_text, created_at) '
+                'VALUES (?, ?, ?, ?, ?)', answer_rows
+            )
+            cursor.executemany(
+                'INSERT INTO doctor_messages (doctor_chat_id, doctor_message_id, question_id) VALUES (?, ?, ?)',
+                copy_rows
+            )
+    with database.transaction() as cursor:
+        cursor.execute('ANALYZE')
+    database.close()
+    return {'questions': questions, 'patients': patients, 'doctors': DOCTORS}
+
+
+def copy_database(source, target):
+    """Копия базы через backup API (вместе с содержимым WAL)"""
+    remove_database(target)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def remove_database(db_file):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+
+
+def measure(func, args_list):
+    """Время каждого вызова func(*args) в секундах"""
+    timings = []
+    for args in args_list:
+        started_at = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def summarize(timings, wall=None):
+    timings = sorted(timings)
+    
+    def us(value):
+        return round(value * 1e6, 1)
+    
+    return {
+        'calls': len(timings),
+        'mean_us': us(statistics.fmean(timings)),
+        'p50_us': us(timings[len(timings) // 2]),
+        'p99_us': us(timings[min(len(timings) - 1, int(len(timings) * 0.99))]),
+        'max_us': us(timings[-1]),
+        'ops_per_s': round(len(timings) / (wall if wall is not None else sum(timings)), 1)
+    }
+
+
+def concurrent_writes(func, args_list, threads):
+    """Параллельные вызовы func из threads потоков: (время каждого вызова, общее время)"""
+    timings = []
+    lock = threading.Lock()
+    chunks = [args_list[i::threads] for i in range(threads)]
+    
+    def worker(chunk):
+        result = measure(func, chunk)
+        with lock:
+            timings.extend(result)
+    
+    started_at = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return timings, time.perf_counter() - started_at
+
+
+def run_benchmarks(db_file, dataset, iterations, write_iterations, threads, seed=2):
+    rng = random.Random(seed)
+    database = Database(db_file)
+    questions = dataset['questions']
+    patients = dataset['patients']
+    
+    def patient():
+        return 1000000 + rng.randrange(patients)
+    
+    def question():
+        return rng.randrange(1, questions + 1)
+    
+    read_cases = {
+        'get_user': (database.get_user, [(patient(),) for _ in range(iterations)]),
+        'get_user_questions': (database.get_user_questions, [(patient(),) for _ in range(iterations)]),
+        'get_user_questions_page': (database.get_user_questions_page, [(patient(),) for _ in range(iterations)]),
+        'get_question': (database.get_question, [(question(),) for _ in range(iterations)]),
+        'get_answer_for_question': (database.get_answer_for_question, [(question(),) for _ in range(iterations)]),
+        'get_question_id_by_doctor_message': (
+            database.get_question_id_by_doctor_message,
+            [(900000 + rng.randrange(DOCTORS), question()) for _ in range(iterations)]
+        ),
+        'search_questions': (database.search_questions, [
+            (rng.choice(SEARCH_QUERIES),) for _ in range(max(1, iterations // 10))
+        ]),
+        'get_channel_member_status': (database.get_channel_member_status, [(patient(),) for _ in range(iterations)]),
+        'get_all_doctors': (database.get_all_doctors, [() for _ in range(iterations)]),
+        'is_doctor': (database.is_doctor, [(900000 + rng.randrange(DOCTORS * 2),) for _ in range(iterations)]),
+        'list_all_doctors': (database.list_all_doctors, [() for _ in range(max(1, iterations // 10))]),
+    }
+    write_cases = {
+        'add_question': (database.add_question, [
+            (patient(), 10 ** 9 + i, rng.choice(QUESTION_TEXTS)) for i in range(write_iterations)
+        ]),
+        'add_answer': (database.add_answer, [
+            (question(), 900000 + rng.randrange(DOCTORS), 10 ** 9 + i, ANSWER_TEXT) for i in range(write_iterations)
+        ]),
+        'add_user': (database.add_user, [
+            (2000000 + i, f"new{i}", f"Yangi {i}") for i in range(write_iterations)
+        ]),
+        'set_channel_member': (database.set_channel_member, [
+            (patient(), 'member') for _ in range(write_iterations)
+        ]),
+    }
+    
+    results = {}
+    for name, (func, args_list) in read_cases.items():
+        func(*args_list[0])  # прогрев кэша соединения и страниц
+        results[name] = summarize(measure(func, args_list))
+    for name, (func, args_list) in write_cases.items():
+        results[name] = summarize(measure(func, args_list))
+    
+    # Групповая запись раскрывается только при параллельных вызовах
+    timings, wall = concurrent_writes(database.add_question, [
+        (patient(), 2 * 10 ** 9 + i, rng.choice(QUESTION_TEXTS)) for i in range(write_iterations * threads)
+    ], threads)
+    results[f'add_question_concurrent_x{threads}'] = summarize(timings, wall)
+    results['upsert_users_batch_500'] = summarize(measure(database.upsert_users, [
+        ([(1000000 + rng.randrange(patients), f"user{i}", f"Bemor {i}") for _ in range(500)],)
+        for i in range(max(1, write_iterations // 10))
+    ]))
+    
+    schema_version = database.schema_version()
+    database.close()
+    return results, schema_version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки database.py на синтетических данных")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="размеры наборов (число вопросов) через запятую")
+    parser.add_argument('--data-dir', default='bench_data', help="каталог для сгенерированных баз")
+    parser.add_argument('--regenerate', action='store_true', help="создать базы заново")
+    parser.add_argument('--iterations', type=int, default=2000, help="вызовов каждого метода чтения")
+    parser.add_argument('--write-iterations', type=int, default=200, help="вызовов каждого метода записи")
+    parser.add_argument('--threads', type=int, default=16, help="потоков для параллельной записи")
+    parser.add_argument('--output', default='bench_results.json', help="файл с результатами (JSON)")
+    args = parser.parse_args()
+    
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'settings': {
+            'iterations': args.iterations,
+            'write_iterations': args.write_iterations,
+            'threads': args.threads
+        },
+        'datasets': []
+    }
+    
+    for size in (int(value) for value in args.sizes.split(',') if value.strip()):
+        db_file = os.path.join(args.data_dir, f"bench_{size}.db")
+        if args.regenerate:
+            remove_database(db_file)
+        if os.path.exists(db_file):
+            dataset = {'questions': size, 'patients': max(1, size // QUESTIONS_PER_PATIENT), 'doctors': DOCTORS}
+            generation_s = None
+        else:
+            print(f"Генерация набора: {size} вопросов...", file=sys.stderr)
+            started_at = time.perf_counter()
+            dataset = generate(db_file, size)
+            generation_s = round(time.perf_counter() - started_at, 1)
+        
+        print(f"Замеры на наборе {size}...", file=sys.stderr)
+        run_file = os.path.join(args.data_dir, f"bench_{size}.run.db")
+        copy_database(db_file, run_file)
+        try:
+            results, schema_version = run_benchmarks(
+                run_file, dataset, args.iterations, args.write_iterations, args.threads
+            )
+        finally:
+            remove_database(run_file)
+        report['datasets'].append(dict(
+            dataset,
+            file_size_mb=round(os.path.getsize(db_file) / 1024 / 1024, 1),
+            generation_s=generation_s,
+            schema_version=schema_version,
+            results=results
+        ))
+        for name, result in results.items():
+            print(f"  {name:40} p50 {result['p50_us']:>10} мкс  p99 {result['p99_us']:>10} мкс  {result['ops_per_s']:>10} оп/с",
+                  file=sys.stderr)
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
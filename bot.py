@@ -1,27 +1,38 @@
 import logging
 import asyncio
-import tempfile
-import os
+import functools
+import html
+import time
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, Contact, Location
+from telegram import InputMediaPhoto, InputMediaVideo, InputMediaDocument
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
+    TypeHandler,
     ContextTypes,
     filters
 )
 from telegram.constants import ParseMode
-from telegram.error import Conflict, TelegramError
+from telegram.error import BadRequest, Conflict, TelegramError
 import config
-from database import Database
-
-# TTS для голосовых ответов врача (узбекский язык)
-try:
-    from gtts import gTTS
-    TTS_AVAILABLE = True
-except ImportError:
-    TTS_AVAILABLE = False
+from database import Database, SNIPPET_START, SNIPPET_END, MEDIA_PLACEHOLDER, VOICE_PLACEHOLDER
+from async_database import AsyncDatabase
+from subscription_cache import SubscriptionCache
+from user_profiles import UserProfileCache
+import tts
+from webhook import run_webhook
+from update_processor import UserOrderedUpdateProcessor
+from persistence import SQLitePersistence
+from similarity import SimilarityIndex
+from media_groups import MediaGroupBuffer
+import metrics
+import tracing
+import profiling
+from outbound import OutboundScheduler, PRIORITY_ANSWER, PRIORITY_QUESTION, PRIORITY_NORMAL
 
 # Настройка логирования
 logging.basicConfig(
@@ -31,28 +42,95 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
-db = Database(config.DATABASE_FILE)
+db = AsyncDatabase(
+    Database(
+        config.DATABASE_FILE,
+        cache_size_kb=config.DB_CACHE_SIZE_KB,
+        mmap_size=config.DB_MMAP_SIZE,
+        group_commit_batch=config.DB_GROUP_COMMIT_BATCH,
+        group_commit_delay=config.DB_GROUP_COMMIT_DELAY_MS / 1000
+    ),
+    reader_threads=config.DB_READER_THREADS
+)
 
-# Максимальная длина текста для TTS (gTTS ограничение)
-TTS_MAX_CHARS = 4000
+# Кэш статуса подписки на канал
+subscription_cache = SubscriptionCache(
+    positive_ttl=config.SUBSCRIPTION_CACHE_TTL,
+    negative_ttl=config.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+    max_size=config.SUBSCRIPTION_CACHE_MAX_SIZE
+)
 
+# Кэш профилей пользователей (изменения пишутся в базу пачками)
+user_profiles = UserProfileCache(max_size=config.USER_CACHE_MAX_SIZE)
 
-def _text_to_speech_sync(text: str, lang: str = "uz") -> str | None:
-    """Синхронно преобразует текст в MP3. Возвращает путь к временному файлу или None."""
-    if not TTS_AVAILABLE or not text or not text.strip():
-        return None
-    text = text.strip()
-    if len(text) > TTS_MAX_CHARS:
-        text = text[: TTS_MAX_CHARS] + "..."
-    try:
-        tts = gTTS(text=text, lang=lang, slow=False)
-        fd, path = tempfile.mkstemp(suffix=".mp3")
-        os.close(fd)
-        tts.save(path)
-        return path
-    except Exception as e:
-        logger.error(f"TTS error: {e}")
-        return None
+# Очередь исходящих сообщений с учетом лимитов Telegram
+outbound = OutboundScheduler(
+    global_rate=config.OUTBOUND_GLOBAL_RATE,
+    per_chat_rate=config.OUTBOUND_PER_CHAT_RATE,
+    per_chat_burst=config.OUTBOUND_PER_CHAT_BURST,
+    workers=config.OUTBOUND_WORKERS,
+    max_retries=config.OUTBOUND_MAX_RETRIES,
+    priority_aging=config.OUTBOUND_PRIORITY_AGING
+)
+
+# Статусы участника канала, при которых пользователь считается подписанным
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+# Фоновые задачи, запущенные при старте бота (отменяются при остановке)
+background_tasks = set()
+
+# Дисковый кэш синтезированных голосовых ответов
+tts_cache = tts.TTSCache(config.TTS_CACHE_DIR, max_bytes=config.TTS_CACHE_MAX_MB * 1024 * 1024)
+
+# Отдельный пул синтеза речи с ограниченной очередью
+tts_pool = tts.TTSWorkerPool(
+    workers=config.TTS_WORKERS,
+    max_queue=config.TTS_MAX_QUEUE,
+    timeout=config.TTS_TIMEOUT
+)
+
+# Сборка альбомов пациентов: файлы с одним media_group_id становятся одним вопросом
+media_group_buffer = MediaGroupBuffer(
+    window=config.MEDIA_GROUP_WINDOW_MS / 1000,
+    max_wait=config.MEDIA_GROUP_MAX_WAIT_MS / 1000
+)
+
+# Индекс похожих вопросов с готовыми ответами (заполняется из базы при старте)
+similarity_index = SimilarityIndex(
+    threshold=config.SIMILARITY_THRESHOLD,
+    max_size=config.SIMILARITY_INDEX_MAX_SIZE
+)
+
+# Сколько вопросов индекса загружается из базы за один вызов в пуле потоков
+SIMILARITY_LOAD_CHUNK = 500
+
+# Метрики: время вызовов базы и текущее состояние очередей и кэшей
+db.observers.append(metrics.observe_db_call)
+db.observers.append(tracing.observe_db_call)
+metrics.REGISTRY.gauge(
+    'tts_queue_length', "Задач синтеза речи в очереди", callback=lambda: tts_pool.stats()['queue_length']
+)
+metrics.REGISTRY.gauge(
+    'tts_running', "Задач синтеза речи в работе", callback=lambda: tts_pool.stats()['running']
+)
+metrics.REGISTRY.callback_counter(
+    'tts_rejected_total', "Задач синтеза, отклоненных из-за переполнения очереди или таймаута",
+    lambda: {'queue_full': tts_pool.stats()['rejected'], 'timeout': tts_pool.stats()['timed_out']}, ('reason',)
+)
+metrics.REGISTRY.gauge(
+    'outbound_queue_depth', "Исходящих сообщений в очереди", ('priority',),
+    callback=lambda: outbound.stats()['queue_depth']
+)
+metrics.REGISTRY.gauge(
+    'cache_entries', "Записей в кэшах процесса", ('cache',),
+    callback=lambda: {
+        'subscription': subscription_cache.stats()['size'],
+        'user_profiles': user_profiles.stats()['size'],
+        'tts': tts_cache.stats()['entries'],
+        'similarity': len(similarity_index),
+    }
+)
+metrics_server = metrics.MetricsServer(config.METRICS_LISTEN, config.METRICS_PORT) if config.METRICS_PORT else None
 
 
 def validate_uzbek_phone(phone):
@@ -88,20 +166,148 @@ def validate_uzbek_phone(phone):
     return None
 
 
-async def check_subscription(user_id, context: ContextTypes.DEFAULT_TYPE):
-    """Проверка подписки пользователя на канал Telegram"""
+def start_background_task(coroutine, name=None):
+    """Запуск фоновой задачи, которая будет отменена при остановке бота"""
+    task = asyncio.create_task(coroutine, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def track_user_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запоминает профиль отправителя любого обновления (запись в базу - в flush_user_profiles)"""
+    user = update.effective_user
+    if user and not user.is_bot:
+        user_profiles.observe(user.id, user.username, user.full_name)
+
+
+async def flush_user_profiles():
+    """Записать накопленные изменения профилей в базу одной пачкой"""
+    rows = user_profiles.take_dirty()
+    if not rows:
+        return
+    try:
+        await db.upsert_users(rows)
+    except Exception as e:
+        logger.error(f"Не удалось сохранить профили пользователей ({len(rows)}): {e}")
+        user_profiles.restore_dirty(rows)
+        return
+    user_profiles.mark_flushed(rows)
+
+
+async def user_profile_flush_loop():
+    """Периодическая запись изменений профилей в базу"""
+    while True:
+        await asyncio.sleep(config.USER_FLUSH_INTERVAL)
+        await flush_user_profiles()
+
+
+async def reply_via_outbound(message, text, priority=PRIORITY_NORMAL, **kwargs):
+    """Ответ на сообщение через очередь исходящих сообщений"""
+    return await outbound.send(message.chat_id, lambda: message.reply_text(text, **kwargs), priority=priority)
+
+
+def is_subscription_channel(chat):
+    """Проверка, что чат - это канал из config.CHANNEL_ID (числовой ID или @username)"""
+    channel_id = str(config.CHANNEL_ID).strip()
+    if channel_id.lstrip('-').isdigit():
+        return chat.id == int(channel_id)
+    return bool(chat.username) and chat.username.lower() == channel_id.lstrip('@').lower()
+
+
+async def check_subscription(user_id, context: ContextTypes.DEFAULT_TYPE, force_refresh=False):
+    """Проверка подписки пользователя на канал Telegram
+    
+    Сначала смотрим кэш, затем локальное зеркало участников канала и только для
+    незнакомых пользователей (или при force_refresh) обращаемся к Telegram API.
+    """
     if not config.CHANNEL_ID:
         return True  # Если канал не указан, разрешаем доступ
     
+    if not force_refresh:
+        cached = subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        status = await db.get_channel_member_status(user_id)
+        if status is not None:
+            subscribed = status in SUBSCRIBED_STATUSES
+            subscription_cache.set(user_id, subscribed)
+            return subscribed
+    
     try:
         # Пытаемся получить информацию о статусе участника
         member = await context.bot.get_chat_member(config.CHANNEL_ID, user_id)
-        return member.status in ['member', 'administrator', 'creator']
+        status = str(member.status)
+        subscribed = status in SUBSCRIBED_STATUSES
+        await db.set_channel_member(user_id, status)
+        subscription_cache.set(user_id, subscribed)
+        return subscribed
     except Exception as e:
         logger.error(f"Ошибка при проверке подписки: {e}")
         return False
 
 
+async def track_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обновление локального зеркала участников канала по событиям вступления/выхода"""
+    chat_member = update.chat_member
+    if not config.CHANNEL_ID or not is_subscription_channel(chat_member.chat):
+        return
+    
+    new_member = chat_member.new_chat_member
+    user_id = new_member.user.id
+    status = str(new_member.status)
+    await db.set_channel_member(user_id, status)
+    subscription_cache.set(user_id, status in SUBSCRIBED_STATUSES)
+    logger.debug(f"Статус пользователя {user_id} в канале: {status}")
+
+
+async def reconcile_channel_members(application: Application):
+    """Сверка локального зеркала участников канала с Telegram при запуске
+    
+    Пока бот был остановлен, события вступления/выхода могли быть пропущены. Администраторов
+    канала получаем одним запросом, а отдельно проверяем только записи, не обновлявшиеся
+    дольше CHANNEL_RECONCILE_MAX_AGE_HOURS (не больше CHANNEL_RECONCILE_LIMIT за запуск):
+    остальные статусы свежие, их поддерживают события chat_member.
+    """
+    bot = application.bot
+    admin_ids = set()
+    try:
+        admins = await bot.get_chat_administrators(config.CHANNEL_ID)
+        await db.set_channel_members([(admin.user.id, str(admin.status)) for admin in admins])
+        admin_ids = {admin.user.id for admin in admins}
+    except Exception as e:
+        logger.warning(f"Не удалось получить администраторов канала: {e}")
+    
+    stale = await db.list_stale_channel_members(
+        config.CHANNEL_RECONCILE_MAX_AGE_HOURS * 3600, config.CHANNEL_RECONCILE_LIMIT
+    )
+    members = []
+    checked = 0
+    updated = 0
+    for user_id, updated_at in stale:
+        if user_id in admin_ids:
+            continue
+        try:
+            member = await bot.get_chat_member(config.CHANNEL_ID, user_id)
+            members.append((str(member.status), user_id, updated_at))
+            checked += 1
+        except Exception as e:
+            logger.debug(f"Не удалось проверить пользователя {user_id} в канале: {e}")
+        if len(members) >= 500:
+            updated += await db.update_channel_members_if_unchanged(members)
+            members = []
+        await asyncio.sleep(config.CHANNEL_RECONCILE_DELAY)
+    
+    if members:
+        updated += await db.update_channel_members_if_unchanged(members)
+    subscription_cache.clear()
+    logger.info(
+        f"Сверка участников канала завершена: администраторов {len(admin_ids)}, "
+        f"устаревших записей проверено {checked}, обновлено {updated}"
+    )
+
+
 async def check_all_subscriptions(user_id, context: ContextTypes.DEFAULT_TYPE):
     """Проверка подписки на Telegram канал"""
     # Проверяем подписку на Telegram канал
@@ -159,9 +365,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
     
-    # Сохраняем пользователя в БД
-    db.add_user(user_id, user.username, user.full_name)
-    
     # Проверяем подписки на все платформы
     subscriptions = await check_all_subscriptions(user_id, context)
     
@@ -193,12 +396,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         return
     
-    # Пользователь подписан - проверяем роль из БД
-    user_info = db.get_user(user_id)
-    user_role = user_info['role'] if user_info else 'user'
-    
+    # Пользователь подписан - проверяем роль
     # Если пользователь врач - показываем функционал для врача
-    if user_role == 'doctor':
+    if await db.is_doctor(user_id):
         doctor_welcome = (
             "👨‍⚕️ <b>Assalomu alaykum, shifokor!</b>\n\n"
             "Siz bemorlardan keladigan savollarni olasiz va ularga javob berishingiz mumkin.\n\n"
@@ -207,7 +407,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "2. Sizga savol bilan xabar keladi\n"
             "3. Xabarga javob (Reply) bering\n"
             "4. Javob bemorga avtomatik yuboriladi\n\n"
-            "💡 <b>Maslahat:</b> Savol bilan kelgan xabarga javob bering - javob bemorga yuboriladi."
+            "💡 <b>Maslahat:</b> Savol bilan kelgan xabarga javob bering - javob bemorga yuboriladi.\n\n"
+            "🔎 Oldingi savol va javoblarni qidirish: <code>/search so'zlar</code>"
         )
         await update.message.reply_text(doctor_welcome, parse_mode=ParseMode.HTML)
         return
@@ -331,8 +532,11 @@ async def check_telegram_subscription_callback(update: Update, context: ContextT
     query = update.callback_query
     user_id = query.from_user.id
     
+    # Пользователь утверждает, что подписался - сбрасываем кэш и проверяем заново
+    subscription_cache.invalidate(user_id)
+    
     # Проверяем подписку
-    is_subscribed = await check_subscription(user_id, context)
+    is_subscribed = await check_subscription(user_id, context, force_refresh=True)
     
     if is_subscribed:
         await query.answer("Telegram каналга обуна тасдиқланди! ✅", show_alert=False)
@@ -452,7 +656,7 @@ async def handle_admin_reply_keyboard(update: Update, context: ContextTypes.DEFA
         return True
     
     elif text == "📋 Shifokorlar ro'yxati":
-        doctors = db.list_all_doctors()
+        doctors = await db.list_all_doctors()
         if not doctors:
             sent_msg = await message.reply_text("📭 Hozircha shifokorlar yo'q.", reply_markup=ReplyKeyboardRemove())
             save_admin_message_id(context, sent_msg.message_id)
@@ -534,6 +738,16 @@ async def handle_admin_reply_keyboard(update: Update, context: ContextTypes.DEFA
         context.user_data['admin_waiting_for'] = 'change_password'
         return True
     
+    elif text == "⏱ Profil olish":
+        # Замер идет в фоне, чтобы не задерживать следующие сообщения администратора
+        start_background_task(send_profile_report(context, user_id), name='profile_capture')
+        sent_msg = await message.reply_text(
+            f"⏱ Profil olinmoqda ({config.PROFILE_DURATION} soniya)...\n\n"
+            "Natija fayl sifatida yuboriladi."
+        )
+        save_admin_message_id(context, sent_msg.message_id)
+        return True
+    
     elif text == "🚪 Chiqish":
         # Удаляем историю сообщений бота
         await delete_bot_messages(update, context)
@@ -561,6 +775,34 @@ async def handle_admin_reply_keyboard(update: Update, context: ContextTypes.DEFA
     return False
 
 
+async def send_profile_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    """Профилирование работающего бота и отправка отчета администратору файлом"""
+    try:
+        report = await profiling.capture(config.PROFILE_DURATION, top=config.PROFILE_TOP)
+    except profiling.ProfilingBusy:
+        await context.bot.send_message(chat_id=chat_id, text="⏳ Profil allaqachon olinmoqda. Biroz kuting.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}")
+        await context.bot.send_message(chat_id=chat_id, text="❌ Profil olishda xatolik yuz berdi.")
+        return
+    
+    # Задача фоновая: ошибку отправки никто не увидит, если не записать ее здесь
+    try:
+        await context.bot.send_document(
+            chat_id=chat_id,
+            document=report.encode('utf-8'),
+            filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt",
+            caption=f"⏱ Profil: {config.PROFILE_DURATION} soniya"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке отчета профилирования: {e}")
+        try:
+            await context.bot.send_message(chat_id=chat_id, text="❌ Profil hisobotini yuborishda xatolik yuz berdi.")
+        except Exception as e:
+            logger.error(f"Не удалось сообщить администратору об ошибке профилирования: {e}")
+
+
 async def delete_bot_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Удаление всех сообщений бота из админ-панели"""
     user_id = update.effective_user.id
@@ -783,7 +1025,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 full_name = None
         
         # Добавляем врача
-        if db.add_doctor(user_id_to_add, username, full_name):
+        if await db.add_doctor(user_id_to_add, username, full_name):
             result_text = (
                 f"✅ Shifokor qo'shildi!\n\n"
                 f"👤 ID: <code>{user_id_to_add}</code>\n"
@@ -823,7 +1065,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await message.reply_text("❌ Noto'g'ri format. ID raqamini yuboring.")
             return True
         
-        if db.remove_doctor(user_id_to_remove):
+        if await db.remove_doctor(user_id_to_remove):
             sent_msg = await message.reply_text(f"✅ Shifokor olib tashlandi!\n\n👤 ID: <code>{user_id_to_remove}</code>", parse_mode=ParseMode.HTML)
             save_admin_message_id(context, sent_msg.message_id)
         else:
@@ -846,7 +1088,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await message.reply_text("❌ Parol kamida 3 belgidan iborat bo'lishi kerak.")
             return True
         
-        db.set_admin_password(new_password)
+        await db.set_admin_password(new_password)
         sent_msg = await message.reply_text(f"✅ Parol muvaffaqiyatli o'zgartirildi!\n\nYangi parol: <code>{new_password}</code>", parse_mode=ParseMode.HTML)
         save_admin_message_id(context, sent_msg.message_id)
         
@@ -857,6 +1099,164 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return False
 
 
+def album_media(messages, caption):
+    """Файлы альбома пациента для send_media_group (подпись - у первого файла)"""
+    media = []
+    for i, message in enumerate(messages):
+        kwargs = {'caption': caption, 'parse_mode': ParseMode.HTML} if i == 0 else {}
+        if message.photo:
+            media.append(InputMediaPhoto(message.photo[-1].file_id, **kwargs))
+        elif message.video:
+            media.append(InputMediaVideo(message.video.file_id, **kwargs))
+        else:
+            media.append(InputMediaDocument(message.document.file_id, **kwargs))
+    return media
+
+
+async def send_question_to_doctor(context: ContextTypes.DEFAULT_TYPE, doctor_id: int, messages, doctor_message: str, reply_markup=None):
+    """Отправка вопроса одному врачу (альбом, медиа пациента с подписью или текст).
+    
+    Возвращает список отправленных сообщений (у альбома их несколько).
+    """
+    if len(messages) > 1:
+        return await context.bot.send_media_group(
+            chat_id=doctor_id,
+            media=album_media(messages, doctor_message)
+        )
+    message = messages[0]
+    if message.photo:
+        sent = await context.bot.send_photo(
+            chat_id=doctor_id,
+            photo=message.photo[-1].file_id,
+            caption=doctor_message,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup
+        )
+    elif message.video:
+        sent = await context.bot.send_video(
+            chat_id=doctor_id,
+            video=message.video.file_id,
+            caption=doctor_message,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup
+        )
+    elif message.document:
+        sent = await context.bot.send_document(
+            chat_id=doctor_id,
+            document=message.document.file_id,
+            caption=doctor_message,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup
+        )
+    else:
+        sent = await context.bot.send_message(
+            chat_id=doctor_id,
+            text=doctor_message,
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup
+        )
+    return [sent]
+
+
+async def send_question_to_doctors(context: ContextTypes.DEFAULT_TYPE, doctors, messages, doctor_message: str, question_id: int,
+                                   reply_markup=None):
+    """Параллельная рассылка вопроса врачам
+    
+    Одновременно выполняется не более config.DOCTOR_FANOUT_CONCURRENCY отправок,
+    ошибка отправки одному врачу не мешает остальным. Для каждой доставленной копии
+    запоминаем (чат врача, ID сообщения) -> ID вопроса, чтобы находить вопрос по ответу
+    врача. Возвращает (доставлено, ошибок).
+    """
+    semaphore = asyncio.Semaphore(config.DOCTOR_FANOUT_CONCURRENCY)
+    
+    async def send(doctor):
+        async with semaphore:
+            try:
+                return await outbound.send(
+                    doctor['user_id'],
+                    lambda: send_question_to_doctor(context, doctor['user_id'], messages, doctor_message, reply_markup),
+                    priority=PRIORITY_QUESTION
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения врачу {doctor['user_id']}: {e}")
+                return None
+    
+    results = await asyncio.gather(*(send(doctor) for doctor in doctors))
+    # Врач может ответить на любой файл альбома - запоминаем все сообщения
+    sent_messages = [(sent.chat_id, sent.message_id) for result in results if result is not None for sent in result]
+    if sent_messages:
+        await db.add_doctor_messages(question_id, sent_messages)
+    delivered = sum(1 for result in results if result is not None)
+    return delivered, len(results) - delivered
+
+
+async def find_similar_answers(question_text, question_id):
+    """Прошлые похожие вопросы с текстовыми ответами врачей (самые похожие первыми)"""
+    if question_text == MEDIA_PLACEHOLDER:
+        return []
+    loop = asyncio.get_running_loop()
+    matches = await loop.run_in_executor(
+        None,
+        functools.partial(
+            similarity_index.query, question_text, limit=config.SIMILARITY_MAX_SUGGESTIONS, exclude=question_id
+        )
+    )
+    if not matches:
+        return []
+    
+    answered = await db.get_questions_with_answers([similar_id for similar_id, _ in matches])
+    suggestions = []
+    for similar_id, score in matches:
+        found = answered.get(similar_id)
+        if found and found['answer_text'] not in (MEDIA_PLACEHOLDER, VOICE_PLACEHOLDER):
+            suggestions.append({
+                'question_id': similar_id,
+                'score': score,
+                'question_text': found['question_text'],
+                'answer_text': found['answer_text']
+            })
+    return suggestions
+
+
+def telegram_len(text):
+    """Длина текста так, как ее ограничивает Telegram (в кодовых единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def shorten(text, limit):
+    """Текст не длиннее limit символов Telegram (с многоточием)"""
+    excess = telegram_len(text) - limit
+    if excess <= 0:
+        return text
+    # Каждый символ - одна или две единицы UTF-16, поэтому хватает одного отсечения
+    return text[:len(text) - excess - 1].rstrip() + "…"
+
+
+def add_similar_answers(doctor_message, suggestions, question_id, limit):
+    """Добавить к сообщению врачу похожие вопросы с ответами и кнопки повторного ответа.
+    
+    Подсказки добавляются, пока сообщение помещается в limit символов (4096 для текста,
+    1024 для подписи к медиа). Возвращает (текст, клавиатура или None).
+    """
+    header = "\n\n🔁 <b>O'xshash savollarga berilgan javoblar:</b>"
+    keyboard = []
+    for suggestion in suggestions:
+        item = (
+            f"\n\n<b>#{suggestion['question_id']}</b> ({round(suggestion['score'] * 100)}%): "
+            f"{html.escape(shorten(suggestion['question_text'], 100))}\n"
+            f"💬 {html.escape(shorten(suggestion['answer_text'], 200))}"
+        )
+        extended = doctor_message + (header if not keyboard else "") + item
+        if telegram_len(extended) > limit:
+            break
+        doctor_message = extended
+        keyboard.append([InlineKeyboardButton(
+            f"♻️ #{suggestion['question_id']} javobini yuborish",
+            callback_data=f"reuse:{question_id}:{suggestion['question_id']}"
+        )])
+    return doctor_message, (InlineKeyboardMarkup(keyboard) if keyboard else None)
+
+
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка сообщений от пользователей"""
     message = update.message
@@ -870,26 +1270,26 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 context.user_data['admin_login'] = login
                 context.user_data['admin_waiting_password'] = True
                 context.user_data.pop('admin_waiting_login', None)
-                await message.reply_text("✅ Login qabul qilindi.\n\nEndi parolni kiriting:")
+                await reply_via_outbound(message, "✅ Login qabul qilindi.\n\nEndi parolni kiriting:")
             else:
-                await message.reply_text("❌ Noto'g'ri login! Qayta urinib ko'ring.\n\nLoginni kiriting:")
+                await reply_via_outbound(message, "❌ Noto'g'ri login! Qayta urinib ko'ring.\n\nLoginni kiriting:")
         else:
-            await message.reply_text("❌ Iltimos, loginni matn shaklida kiriting.")
+            await reply_via_outbound(message, "❌ Iltimos, loginni matn shaklida kiriting.")
         return
     
     if 'admin_waiting_password' in context.user_data and context.user_data['admin_waiting_password']:
         # Пользователь вводит пароль (только текст, не контакт)
         if message.text:
             password = message.text.strip()
-            if password == db.get_admin_password():
+            if password == await db.get_admin_password():
                 context.user_data['admin_authorized'] = True
                 context.user_data.pop('admin_waiting_password', None)
                 context.user_data.pop('admin_login', None)
                 await show_admin_panel(update, context)
             else:
-                await message.reply_text("❌ Noto'g'ri parol! Qayta urinib ko'ring.\n\nParolni kiriting:")
+                await reply_via_outbound(message, "❌ Noto'g'ri parol! Qayta urinib ko'ring.\n\nParolni kiriting:")
         else:
-            await message.reply_text("❌ Iltimos, parolni matn shaklida kiriting.")
+            await reply_via_outbound(message, "❌ Iltimos, parolni matn shaklida kiriting.")
         return
     
     # Проверяем, не ожидает ли админ ввода данных для админ-панели
@@ -915,7 +1315,8 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         reply_markup = InlineKeyboardMarkup(keyboard)
         missing_text = "\n".join([f"• {sub}" for sub in missing_subs])
         
-        await message.reply_text(
+        await reply_via_outbound(
+            message,
             "⚠️ <b>Ботдан фойдаланиш учун Telegram каналга обуна бўлишингиз керак:</b>\n\n"
             f"{missing_text}\n\n"
             "Юқоридаги тугмаларни босиб обуна бўлинг ва тасдиқланг!",
@@ -933,41 +1334,61 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             "📱 <a href=\"tel:+99899899489215\">99 899-489-92-15</a>\n\n"
             "💬 <i>Рақамни босиб қўнғироқ қилинг</i>"
         )
-        await message.reply_text(contact_text, parse_mode=ParseMode.HTML)
+        await reply_via_outbound(message, contact_text, parse_mode=ParseMode.HTML)
         return
     
     # Проверяем, нажата ли кнопка "📍 Klinika manzili"
     if message.text and message.text.strip() == "📍 Klinika manzili":
         # Координаты клиники: 41.287102, 69.184537
-        await message.reply_location(
-            latitude=41.287102,
-            longitude=69.184537
+        await outbound.send(
+            message.chat_id,
+            lambda: message.reply_location(latitude=41.287102, longitude=69.184537)
         )
         # Отправляем сообщение с адресом
         address_text = (
             "📍 <b>Клиника манзили:</b>\n\n"
             "Тошкент шаҳри, Учтепа тумани, 23-квартал, 59-уй"
         )
-        await message.reply_text(address_text, parse_mode=ParseMode.HTML)
+        await reply_via_outbound(message, address_text, parse_mode=ParseMode.HTML)
         return
     
     # Проверяем, что есть содержимое сообщения
     question_text = message.text or message.caption
     if not question_text and not (message.photo or message.video or message.document):
-        await message.reply_text(
+        await reply_via_outbound(
+            message,
             "❓ Iltimos, savolingizni matn, rasm, video yoki hujjat shaklida yuboring."
         )
         return
     
+    # Файлы альбома приходят отдельными обновлениями - собираем их в один вопрос
+    if message.media_group_id and (message.photo or message.video or message.document):
+        media_group_buffer.add(message, functools.partial(submit_question, context, user))
+        return
+    
+    await submit_question(context, user, [message])
+
+
+async def submit_question(context: ContextTypes.DEFAULT_TYPE, user, messages):
+    """Сохранение вопроса пациента и рассылка врачам.
+    
+    messages - сообщение пациента или все сообщения альбома (тогда это один вопрос
+    с подписями всех файлов, а врачам альбом отправляется одним send_media_group).
+    """
+    user_id = user.id
+    message = messages[0]
+    
     # Если нет текста, но есть медиа
+    question_text = "\n\n".join(filter(None, (m.text or m.caption for m in messages)))
     if not question_text:
-        question_text = "Media-xabar"
+        question_text = MEDIA_PLACEHOLDER
     
     # Сохраняем вопрос в БД
-    question_id = db.add_question(user_id, message.message_id, question_text)
+    question_id = await db.add_question(user_id, message.message_id, question_text)
+    metrics.QUESTIONS_RECEIVED.inc()
     
     # Получаем всех врачей
-    doctors = db.get_all_doctors()
+    doctors = await db.get_all_doctors()
     
     if not doctors:
         reply_text = (
@@ -976,54 +1397,45 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             "Shifokor mavjud bo'lgach, sizga javob beradi.\n\n"
             "💡 Savollaringiz holatini kuzatish uchun /myquestions buyrug'idan foydalaning."
         )
-        await message.reply_text(reply_text, parse_mode=ParseMode.HTML)
+        await reply_via_outbound(message, reply_text, parse_mode=ParseMode.HTML)
         return
     
-    # Формируем сообщение для врачей
+    # Формируем сообщение для врачей. Подпись к медиа (и к альбому) - не больше 1024 символов,
+    # поэтому длинный текст вопроса сокращается, полностью он сохранен в базе
     user_name = user.full_name or user.username or f"Foydalanuvchi {user_id}"
-    doctor_message = (
+    limit = 1024 if (message.photo or message.video or message.document) else 4096
+    header = (
         f"❓ <b>Yangi savol bemordan:</b>\n\n"
         f"👤 {user_name}\n"
         f"ID: {user_id}\n\n"
-        f"📝 <b>Savol:</b>\n{question_text}\n\n"
-        f"ID savol: {question_id}"
+        f"📝 <b>Savol:</b>\n"
+    )
+    footer = f"\n\nID savol: {question_id}"
+    doctor_message = header + shorten(question_text, limit - telegram_len(header + footer)) + footer
+    
+    # Похожие вопросы с готовыми ответами - врач может отправить такой ответ одной кнопкой
+    # (к альбому кнопки прикрепить нельзя, поэтому для альбомов подсказок нет)
+    reply_markup = None
+    if len(messages) == 1:
+        suggestions = await find_similar_answers(question_text, question_id)
+        doctor_message, reply_markup = add_similar_answers(doctor_message, suggestions, question_id, limit)
+    
+    # Отправляем вопрос всем врачам параллельно
+    delivered, failed = await send_question_to_doctors(
+        context, doctors, messages, doctor_message, question_id, reply_markup
     )
+    logger.info(f"Вопрос {question_id} отправлен врачам: доставлено {delivered}, ошибок {failed}")
     
-    # Отправляем вопрос всем врачам
-    sent_count = 0
-    for doctor in doctors:
-        try:
-            # Отправляем сообщение врачу
-            if message.photo:
-                await context.bot.send_photo(
-                    chat_id=doctor['user_id'],
-                    photo=message.photo[-1].file_id,
-                    caption=doctor_message,
-                    parse_mode=ParseMode.HTML
-                )
-            elif message.video:
-                await context.bot.send_video(
-                    chat_id=doctor['user_id'],
-                    video=message.video.file_id,
-                    caption=doctor_message,
-                    parse_mode=ParseMode.HTML
-                )
-            elif message.document:
-                await context.bot.send_document(
-                    chat_id=doctor['user_id'],
-                    document=message.document.file_id,
-                    caption=doctor_message,
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=doctor['user_id'],
-                    text=doctor_message,
-                    parse_mode=ParseMode.HTML
-                )
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения врачу {doctor['user_id']}: {e}")
+    if not delivered:
+        # Ни один врач не получил вопрос - не сообщаем пациенту, что он отправлен
+        logger.error(f"Вопрос {question_id} не доставлен ни одному врачу")
+        reply_text = (
+            "⚠️ <b>Savolingizni shifokorlarga yuborib bo'lmadi</b>\n\n"
+            f"📝 Savol saqlandi (ID: <code>{question_id}</code>)\n"
+            "Iltimos, birozdan keyin qayta urinib ko'ring."
+        )
+        await reply_via_outbound(message, reply_text, parse_mode=ParseMode.HTML)
+        return
     
     # Формируем информативное сообщение
     reply_text = (
@@ -1033,7 +1445,7 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         "💡 Savollaringiz holatini ko'rish uchun /myquestions buyrug'idan foydalaning."
     )
     
-    await message.reply_text(reply_text, parse_mode=ParseMode.HTML)
+    await reply_via_outbound(message, reply_text, parse_mode=ParseMode.HTML)
 
 
 async def my_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1064,33 +1476,154 @@ async def my_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Получаем вопросы пользователя
-    questions = db.get_user_questions(user_id, limit=10)
+    # Первая страница вопросов пользователя (самые новые) вместе с ответами
+    page = await db.get_user_questions_page(user_id, limit=config.MY_QUESTIONS_PAGE_SIZE)
     
-    if not questions:
+    if not page['questions']:
         await update.message.reply_text(
             "📭 Sizda hozircha savollar yo'q.\n\n"
             "Savolingizni botga yuboring, shifokor sizga javob beradi."
         )
         return
     
-    # Формируем сообщение со списком вопросов
+    text, reply_markup = format_questions_page(page)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+
+
+def format_questions_page(page):
+    """Текст и кнопки навигации для страницы /myquestions"""
     message_text = "📋 <b>Sizning savollaringiz:</b>\n\n"
     
-    for i, q in enumerate(questions, 1):
+    for q in page['questions']:
         status_emoji = "✅" if q['status'] == 'answered' else "⏳"
         status_text = "Javob berildi" if q['status'] == 'answered' else "Javob kutilmoqda"
         
-        # Обрезаем длинный текст вопроса
-        question_preview = q['question_text'][:50] + "..." if len(q['question_text']) > 50 else q['question_text']
+        # Обрезаем длинный текст вопроса и ответа
+        question_preview = q['question_text'][:100] + "..." if len(q['question_text']) > 100 else q['question_text']
         
         message_text += f"{status_emoji} <b>Savol #{q['question_id']}</b> ({status_text})\n"
-        message_text += f"   {question_preview}\n\n"
+        message_text += f"   {html.escape(question_preview)}\n"
+        answer = q['answer']
+        if answer:
+            answer_preview = answer['answer_text'][:200] + "..." if len(answer['answer_text']) > 200 else answer['answer_text']
+            message_text += f"   👨‍⚕️ <b>{html.escape(answer['doctor_name'])}:</b> {html.escape(answer_preview)}\n"
+        message_text += "\n"
+    
+    # В callback_data - ID крайнего вопроса страницы, от него строится следующая страница
+    buttons = []
+    if page['has_newer']:
+        buttons.append(InlineKeyboardButton("⬅️ Yangiroq", callback_data=f"myq:newer:{page['questions'][0]['question_id']}"))
+    if page['has_older']:
+        buttons.append(InlineKeyboardButton("Eskiroq ➡️", callback_data=f"myq:older:{page['questions'][-1]['question_id']}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return message_text, reply_markup
+
+
+async def my_questions_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переход между страницами /myquestions"""
+    query = update.callback_query
+    await query.answer()
     
-    if len(questions) == 10:
-        message_text += "\n(Oxirgi 10 ta savol ko'rsatilmoqda)"
+    try:
+        _, direction, question_id = query.data.split(':')
+        question_id = int(question_id)
+    except ValueError:
+        return
     
-    await update.message.reply_text(message_text, parse_mode=ParseMode.HTML)
+    if direction == 'newer':
+        page = await db.get_user_questions_page(query.from_user.id, limit=config.MY_QUESTIONS_PAGE_SIZE, newer_than=question_id)
+    else:
+        page = await db.get_user_questions_page(query.from_user.id, limit=config.MY_QUESTIONS_PAGE_SIZE, older_than=question_id)
+    if not page['questions']:
+        return
+    
+    text, reply_markup = format_questions_page(page)
+    try:
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие на ту же кнопку - сообщение не изменилось
+        logger.debug(f"Не удалось обновить страницу вопросов: {e}")
+
+
+def highlight_snippet(snippet):
+    """Сниппет поиска в HTML: текст экранируется, совпадения выделяются жирным"""
+    return html.escape(snippet).replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>")
+
+
+def format_search_page(query, page, offset):
+    """Текст и кнопки навигации для страницы результатов /search"""
+    page_size = config.SEARCH_PAGE_SIZE
+    message_text = f"🔎 <b>Qidiruv:</b> {html.escape(query)}\n"
+    message_text += f"Sahifa {offset // page_size + 1}\n\n"
+    
+    for result in page['results']:
+        status_emoji = "✅" if result['status'] == 'answered' else "⏳"
+        message_text += f"{status_emoji} <b>Savol #{result['question_id']}</b> ({result['created_at'][:10]})\n"
+        message_text += f"❓ {highlight_snippet(result['question_snippet'])}\n"
+        if result['answer_snippet']:
+            message_text += f"💬 {highlight_snippet(result['answer_snippet'])}\n"
+        message_text += "\n"
+    
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"srch:{max(0, offset - page_size)}"))
+    if page['has_more']:
+        buttons.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"srch:{offset + page_size}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return message_text, reply_markup
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск по прошлым вопросам и ответам (только для врачей)"""
+    user_id = update.effective_user.id
+    if not await db.is_doctor(user_id):
+        await update.message.reply_text("⛔ Bu buyruq faqat shifokorlar uchun.")
+        return
+    
+    query = " ".join(context.args).strip()
+    if not query:
+        await update.message.reply_text(
+            "🔎 Qidiruv uchun so'zlarni kiriting.\n\n"
+            "Masalan: <code>/search bel og'riq</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    page = await db.search_questions(query, limit=config.SEARCH_PAGE_SIZE, max_candidates=config.SEARCH_MAX_CANDIDATES)
+    if not page['results']:
+        await update.message.reply_text(f"📭 \"{query}\" bo'yicha hech narsa topilmadi.")
+        return
+    
+    # Запрос нужен для следующих страниц (в callback_data он может не поместиться)
+    context.user_data['search_query'] = query
+    text, reply_markup = format_search_page(query, page, 0)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переход между страницами результатов /search"""
+    query = update.callback_query
+    await query.answer()
+    
+    search_query = context.user_data.get('search_query')
+    if not search_query or not await db.is_doctor(query.from_user.id):
+        return
+    try:
+        offset = max(0, int(query.data.split(':', 1)[1]))
+    except ValueError:
+        return
+    
+    page = await db.search_questions(
+        search_query, limit=config.SEARCH_PAGE_SIZE, offset=offset, max_candidates=config.SEARCH_MAX_CANDIDATES
+    )
+    if not page['results']:
+        return
+    
+    text, reply_markup = format_search_page(search_query, page, offset)
+    try:
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+    except BadRequest as e:
+        logger.debug(f"Не удалось обновить страницу поиска: {e}")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1164,7 +1697,8 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("➕ Shifokor qo'shish"), KeyboardButton("➖ Shifokorni olib tashlash")],
         [KeyboardButton("📋 Shifokorlar ro'yxati"), KeyboardButton("🔍 Kanalda qidirish")],
-        [KeyboardButton("🔑 Parolni o'zgartirish"), KeyboardButton("🚪 Chiqish")]
+        [KeyboardButton("🔑 Parolni o'zgartirish"), KeyboardButton("⏱ Profil olish")],
+        [KeyboardButton("🚪 Chiqish")]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
     
@@ -1212,7 +1746,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data['admin_waiting_for'] = 'remove_doctor'
     
     elif callback_data == 'admin_list_doctors':
-        doctors = db.list_all_doctors()
+        doctors = await db.list_all_doctors()
         if not doctors:
             await query.edit_message_text("📭 Hozircha shifokorlar yo'q.")
             return
@@ -1274,47 +1808,133 @@ async def set_doctor_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("⚠️ Bu buyruq eskirgan. Iltimos, /admin buyrug'idan foydalaning.")
 
 
+async def send_tts_answer(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, caption: str, lang: str = "uz"):
+    """Отправка текстового ответа голосовым сообщением
+    
+    Если такой текст уже отправлялся, повторно используем file_id из Telegram (без синтеза и
+    загрузки). Иначе берем MP3 из дискового кэша или синтезируем его. Возвращает отправленное
+    сообщение или None, если голосовое сообщение отправить не удалось.
+    """
+    if not config.TTS_ENABLED:
+        return None
+    
+    key = tts.cache_key(text, lang)
+    
+    file_id = await db.get_tts_file_id(key)
+    if file_id:
+        try:
+            sent_message = await outbound.send(chat_id, lambda: context.bot.send_voice(
+                chat_id=chat_id,
+                voice=file_id,
+                caption=caption,
+                parse_mode=ParseMode.HTML,
+            ), priority=PRIORITY_ANSWER)
+            await db.touch_tts_file_id(key)
+            return sent_message
+        except BadRequest as e:
+            logger.warning(f"file_id голосового сообщения недействителен, загружаем заново: {e}")
+            await db.delete_tts_file_id(key)
+    
+    started_at = time.perf_counter()
+    try:
+        with tracing.span('tts', 'synthesize', chars=len(text)):
+            voice_data = await tts.synthesize(
+                text, tts_pool, lang, cache=tts_cache, chunk_chars=config.TTS_CHUNK_CHARS
+            )
+    except (tts.TTSQueueFull, asyncio.TimeoutError) as e:
+        logger.warning(f"Синтез речи недоступен ({e!r}), ответ будет отправлен текстом")
+        return None
+    finally:
+        metrics.TTS_DURATION.observe(time.perf_counter() - started_at)
+    if not voice_data:
+        return None
+    
+    sent_message = await outbound.send(chat_id, lambda: context.bot.send_voice(
+        chat_id=chat_id,
+        voice=voice_data,
+        filename="javob.mp3",
+        caption=caption,
+        parse_mode=ParseMode.HTML,
+    ), priority=PRIORITY_ANSWER)
+    if sent_message.voice:
+        await db.set_tts_file_id(key, sent_message.voice.file_id, config.TTS_CACHE_MAX_FILE_IDS)
+    return sent_message
+
+
+async def send_text_answer(context: ContextTypes.DEFAULT_TYPE, question, doctor_name: str, answer_text: str):
+    """Текстовый ответ врача пациенту: голосовым сообщением (TTS), если синтез недоступен - текстом.
+    
+    Возвращает сообщение, отправленное пациенту.
+    """
+    question_preview = question['question_text'][:100] + "..." if len(question['question_text']) > 100 else question['question_text']
+    patient_id = question['user_id']
+    caption_short = (
+        f"👨‍⚕️ <b>Javob shifokordan {doctor_name}</b>\n\n"
+        f"📝 <b>Sizning savolingiz:</b>\n{question_preview}"
+    )
+    sent_message = await send_tts_answer(context, patient_id, answer_text, caption_short)
+    if not sent_message:
+        # Fallback: если TTS недоступен или ошибка — отправляем текстом
+        patient_message = f"{caption_short}\n\n💬 <b>Javob:</b>\n{answer_text}"
+        sent_message = await outbound.send(patient_id, lambda: context.bot.send_message(
+            chat_id=patient_id,
+            text=patient_message,
+            parse_mode=ParseMode.HTML,
+        ), priority=PRIORITY_ANSWER)
+    return sent_message
+
+
+async def index_answered_question(question):
+    """Добавить отвеченный вопрос в индекс похожих вопросов"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, similarity_index.add, question['question_id'], question['question_text'])
+
+
 async def handle_doctor_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ответов врачей на вопросы (скрытый функционал)"""
     user = update.effective_user
     user_id = user.id
     message = update.message
     
-    # Проверяем, является ли пользователь врачом
-    user_info = db.get_user(user_id)
-    if not user_info or user_info['role'] != 'doctor':
-        return
-    
     # Проверяем, является ли это ответом на сообщение
     if not message.reply_to_message:
         return
     
+    # Отвечать может только действующий врач (роль проверяется по списку в памяти, без запроса
+    # к базе): врач, удаленный из списка, не должен отвечать на старые копии вопросов
+    if not await db.is_doctor(user_id):
+        return
+    
     replied_message = message.reply_to_message
-    replied_text = replied_message.text or replied_message.caption or ""
     
-    # Извлекаем ID вопроса из текста сообщения
-    question_id = None
-    if "ID savol:" in replied_text or "ID вопроса:" in replied_text:
-        try:
-            # Пробуем найти ID вопроса
-            text_to_search = "ID savol:" if "ID savol:" in replied_text else "ID вопроса:"
-            question_id = int(replied_text.split(text_to_search)[-1].strip().split()[0])
-        except:
-            pass
+    # Ищем вопрос по ID сообщения, на которое ответил врач (копии вопросов записываются при рассылке)
+    question_id = await db.get_question_id_by_doctor_message(message.chat_id, replied_message.message_id)
+    
+    if not question_id:
+        # Сообщения, разосланные до появления таблицы doctor_messages:
+        # извлекаем ID вопроса из текста сообщения
+        replied_text = replied_message.text or replied_message.caption or ""
+        if "ID savol:" in replied_text or "ID вопроса:" in replied_text:
+            try:
+                # Пробуем найти ID вопроса
+                text_to_search = "ID savol:" if "ID savol:" in replied_text else "ID вопроса:"
+                question_id = int(replied_text.split(text_to_search)[-1].strip().split()[0])
+            except:
+                pass
     
     if not question_id:
-        await message.reply_text("Savolni aniqlab bo'lmadi. Savol bilan xabarga javob bering.")
+        await reply_via_outbound(message, "Savolni aniqlab bo'lmadi. Savol bilan xabarga javob bering.")
         return
     
     # Получаем информацию о вопросе
-    question = db.get_question(question_id)
+    question = await db.get_question(question_id)
     if not question:
-        await message.reply_text("Savol topilmadi.")
+        await reply_via_outbound(message, "Savol topilmadi.")
         return
     
     # Сохраняем ответ в БД (для голоса текста нет — храним пометку)
-    answer_text = message.text or message.caption or (None if message.voice else "Media-xabar")
-    db.add_answer(question_id, user_id, message.message_id, answer_text or "Ovozli xabar")
+    answer_text = message.text or message.caption or (None if message.voice else MEDIA_PLACEHOLDER)
+    await db.add_answer(question_id, user_id, message.message_id, answer_text or VOICE_PLACEHOLDER)
     
     # Отправляем ответ пациенту
     doctor_name = user.full_name or user.username or "Shifokor"
@@ -1326,6 +1946,7 @@ async def handle_doctor_reply(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"💬 <b>Javob:</b>\n{answer_text or '🎤 Ovozli xabar'}"
     )
     
+    patient_id = question['user_id']
     try:
         if message.voice:
             # Врач отправил голосовое — пересылаем пациенту как есть
@@ -1333,71 +1954,110 @@ async def handle_doctor_reply(update: Update, context: ContextTypes.DEFAULT_TYPE
                 f"👨‍⚕️ <b>Javob shifokordan {doctor_name}</b>\n\n"
                 f"📝 <b>Sizning savolingiz:</b>\n{question_preview}"
             )
-            await context.bot.send_voice(
-                chat_id=question['user_id'],
+            await outbound.send(patient_id, lambda: context.bot.send_voice(
+                chat_id=patient_id,
                 voice=message.voice.file_id,
                 caption=caption_voice,
                 parse_mode=ParseMode.HTML,
-            )
+            ), priority=PRIORITY_ANSWER)
         elif message.photo:
-            await context.bot.send_photo(
-                chat_id=question['user_id'],
+            await outbound.send(patient_id, lambda: context.bot.send_photo(
+                chat_id=patient_id,
                 photo=message.photo[-1].file_id,
                 caption=patient_message,
                 parse_mode=ParseMode.HTML
-            )
+            ), priority=PRIORITY_ANSWER)
         elif message.video:
-            await context.bot.send_video(
-                chat_id=question['user_id'],
+            await outbound.send(patient_id, lambda: context.bot.send_video(
+                chat_id=patient_id,
                 video=message.video.file_id,
                 caption=patient_message,
                 parse_mode=ParseMode.HTML
-            )
+            ), priority=PRIORITY_ANSWER)
         elif message.document:
-            await context.bot.send_document(
-                chat_id=question['user_id'],
+            await outbound.send(patient_id, lambda: context.bot.send_document(
+                chat_id=patient_id,
                 document=message.document.file_id,
                 caption=patient_message,
                 parse_mode=ParseMode.HTML
-            )
+            ), priority=PRIORITY_ANSWER)
         else:
-            # Текстовый ответ врача → отправляем пациенту голосовым сообщением (TTS)
-            voice_path = None
-            try:
-                loop = asyncio.get_event_loop()
-                voice_path = await loop.run_in_executor(
-                    None, _text_to_speech_sync, answer_text, "uz"
-                )
-                if voice_path:
-                    caption_short = (
-                        f"👨‍⚕️ <b>Javob shifokordan {doctor_name}</b>\n\n"
-                        f"📝 <b>Sizning savolingiz:</b>\n{question_preview}"
-                    )
-                    with open(voice_path, "rb") as voice_file:
-                        await context.bot.send_voice(
-                            chat_id=question['user_id'],
-                            voice=voice_file,
-                            caption=caption_short,
-                            parse_mode=ParseMode.HTML,
-                        )
-                else:
-                    # Fallback: если TTS недоступен или ошибка — отправляем текстом
-                    await context.bot.send_message(
-                        chat_id=question['user_id'],
-                        text=patient_message,
-                        parse_mode=ParseMode.HTML,
-                    )
-            finally:
-                if voice_path and os.path.exists(voice_path):
-                    try:
-                        os.unlink(voice_path)
-                    except OSError:
-                        pass
+            await send_text_answer(context, question, doctor_name, answer_text)
+        metrics.QUESTIONS_ANSWERED.inc()
+        
+        # Вопрос с текстовым ответом можно предлагать врачам для похожих вопросов
+        if answer_text and answer_text != MEDIA_PLACEHOLDER:
+            await index_answered_question(question)
         
-        await message.reply_text("✅ Javob bemorga yuborildi.")
+        await reply_via_outbound(message, "✅ Javob bemorga yuborildi.")
     except Exception as e:
         logger.error(f"Ошибка при отправке ответа пациенту: {e}")
-        await message.reply_text("❌ Javob yuborishda xatolik yuz berdi. Keyinroq urinib ko'ring.")
+        await reply_via_outbound(message, "❌ Javob yuborishda xatolik yuz berdi. Keyinroq urinib ko'ring.")
+
+
+async def reuse_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ответ на новый вопрос готовым ответом на похожий вопрос (кнопка под вопросом у врача)"""
+    query = update.callback_query
+    doctor = query.from_user
+    if not await db.is_doctor(doctor.id):
+        await query.answer()
+        return
+    
+    try:
+        _, question_id, similar_id = query.data.split(':')
+        question_id, similar_id = int(question_id), int(similar_id)
+    except ValueError:
+        await query.answer()
+        return
+    
+    question = await db.get_question(question_id)
+    answer = await db.get_answer_for_question(similar_id)
+    if not question or not answer or answer['answer_text'] in (MEDIA_PLACEHOLDER, VOICE_PLACEHOLDER):
+        await query.answer("Savol yoki javob topilmadi.", show_alert=True)
+        return
+    # Вопрос занимается одним UPDATE: повторное нажатие или второй врач получат отказ
+    if not await db.claim_question(question_id):
+        await query.answer("Bu savolga allaqachon javob berilgan.", show_alert=True)
+        return
+    await query.answer()
+    
+    answer_text = answer['answer_text']
+    doctor_name = doctor.full_name or doctor.username or "Shifokor"
+    try:
+        sent_message = await send_text_answer(context, question, doctor_name, answer_text)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке готового ответа пациенту: {e}")
+        # Ответ не дошел - возвращаем вопрос в ожидание, чтобы врач мог повторить
+        await db.release_question(question_id)
+        await reply_via_outbound(query.message, "❌ Javob yuborishda xatolik yuz berdi. Keyinroq urinib ko'ring.")
+        return
+    
+    # Ответ записывается только после доставки; message_id - сообщение с ответом у пациента
+    await db.add_answer(question_id, doctor.id, sent_message.message_id, answer_text)
+    metrics.QUESTIONS_ANSWERED.inc()
+    await index_answered_question(question)
+    
+    # Убираем кнопки, чтобы ответ не отправили повторно
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except BadRequest as e:
+        logger.debug(f"Не удалось убрать кнопки под вопросом {question_id}: {e}")
+    await reply_via_outbound(query.message, f"✅ #{similar_id} savolga berilgan javob bemorga yuborildi.")
+
+
+async def load_similarity_index():
+    """Заполнение индекса похожих вопросов последними отвеченными вопросами из базы"""
+    if not config.SIMILARITY_INDEX_MAX_SIZE:
+        return
+    started_at = time.perf_counter()
+    rows = await db.get_answered_questions(config.SIMILARITY_INDEX_MAX_SIZE)
+    loop = asyncio.get_running_loop()
+    added = 0
+    # Бот уже принимает обновления: подписи считаются пачками, чтобы не занимать GIL надолго
+    for start in range(0, len(rows), SIMILARITY_LOAD_CHUNK):
+        chunk = rows[start:start + SIMILARITY_LOAD_CHUNK]
+        added += await loop.run_in_executor(None, similarity_index.add_many, chunk)
+    logger.info(f"Индекс похожих вопросов заполнен: {added} вопросов за {time.perf_counter() - started_at:.1f} сек")
 
 
 async def post_init(application: Application):
@@ -1427,6 +2087,40 @@ async def post_init(application: Application):
         await bot.set_my_short_description("Шерзод Тойиров - тиббий консультация")
     except Exception as e:
         logger.warning(f"Не удалось установить описание бота: {e}")
+    
+    await outbound.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    start_background_task(user_profile_flush_loop(), name='user_profile_flush')
+    start_background_task(load_similarity_index(), name='load_similarity_index')
+    
+    # Сверяем локальное зеркало участников канала в фоне
+    if config.CHANNEL_ID:
+        start_background_task(reconcile_channel_members(application), name='reconcile_channel_members')
+
+
+async def post_stop(application: Application):
+    """Остановка приема обновлений: накопленные альбомы отправляются, пока бот еще работает"""
+    await media_group_buffer.flush_all()
+
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке приложения"""
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await flush_user_profiles()
+    await outbound.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    tts_pool.shutdown()
+    logger.info(f"Статистика кэша подписок: {subscription_cache.stats()}")
+    logger.info(f"Статистика кэша профилей: {user_profiles.stats()}")
+    logger.info(f"Статистика кэша TTS: {tts_cache.stats()}")
+    logger.info(f"Статистика пула TTS: {tts_pool.stats()}")
+    logger.info(f"Статистика индекса похожих вопросов: {similarity_index.stats()}")
+    logger.info(f"Статистика альбомов: {media_group_buffer.stats()}")
+    await db.close()
 
 
 def main():
@@ -1435,17 +2129,48 @@ def main():
         logger.error("BOT_TOKEN не установлен! Установите его в файле .env")
         return
     
+    tracing.configure(config.TRACE_LOG_FILE, config.TRACE_MIN_DURATION_MS)
+    
     # Создаем приложение
-    application = Application.builder().token(config.BOT_TOKEN).post_init(post_init).build()
+    # Обновления разных пользователей обрабатываются параллельно, одного пользователя - по порядку
+    # Запросы к Bot API идут через InstrumentedRequest (время и ошибки по методам); размеры
+    # пулов соединений - как у PTB по умолчанию
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(metrics.InstrumentedRequest(connection_pool_size=1))
+    )
+    if config.BOT_API_BASE_URL:
+        builder = builder.base_url(config.BOT_API_BASE_URL)
+    application = (
+        builder
+        .concurrent_updates(UserOrderedUpdateProcessor(config.MAX_CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence(db, update_interval=config.PERSISTENCE_UPDATE_INTERVAL))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Профили пользователей запоминаются до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, track_user_profile), group=-1)
     
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("myquestions", my_questions))
+    application.add_handler(CommandHandler("search", search_command))  # Поиск для врачей
     application.add_handler(CommandHandler("admin", admin_command))  # Команда для управления врачами с авторизацией
     application.add_handler(CommandHandler("setdoctor", set_doctor_role))  # Устаревшая команда
     application.add_handler(CallbackQueryHandler(get_invite_link_callback, pattern='get_invite_link'))
     application.add_handler(CallbackQueryHandler(check_telegram_subscription_callback, pattern='check_telegram_sub'))
+    application.add_handler(CallbackQueryHandler(my_questions_page_callback, pattern='^myq:'))
+    application.add_handler(CallbackQueryHandler(search_page_callback, pattern='^srch:'))
+    application.add_handler(CallbackQueryHandler(reuse_answer_callback, pattern='^reuse:'))
+    
+    # Отслеживание вступлений/выходов из канала (бот должен быть администратором канала)
+    application.add_handler(ChatMemberHandler(track_channel_member, ChatMemberHandler.CHAT_MEMBER))
     
     # Обработчик ответов врачей (должен быть до обычных сообщений)
     application.add_handler(MessageHandler(filters.REPLY & (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.VOICE), handle_doctor_reply))
@@ -1474,10 +2199,30 @@ def main():
     
     application.add_error_handler(error_handler)
     
+    # Время выполнения и ошибки каждого обработчика
+    metrics.instrument_handlers(application)
+    
     # Запускаем бота
-    logger.info("Бот запущен")
     try:
-        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        if config.BOT_MODE == 'webhook':
+            if not config.WEBHOOK_SECRET_TOKEN:
+                logger.error("WEBHOOK_SECRET_TOKEN не установлен! Он обязателен в режиме webhook")
+                return
+            logger.info("Бот запущен (webhook)")
+            asyncio.run(run_webhook(
+                application,
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                path=config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET_TOKEN,
+                webhook_url=config.WEBHOOK_URL or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            ))
+        else:
+            logger.info("Бот запущен")
+            application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
@@ -9,6 +9,18 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 # ID канала, на который должны подписаться пользователи (например: @channel_username или -1001234567890)
 CHANNEL_ID = os.getenv('CHANNEL_ID', '')
 
+# Режим получения обновлений: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Настройки webhook: публичный URL (если пустой, setWebhook не вызывается - для локальной проверки),
+# адрес и порт встроенного сервера, путь, секретный токен и лимит одновременных соединений
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
 # ID канала должен быть числом (если передан username, нужно конвертировать)
 # Для публичных каналов можно использовать username, для приватных - числовой ID
 
@@ -16,6 +28,102 @@ CHANNEL_ID = os.getenv('CHANNEL_ID', '')
 INSTAGRAM_URL = 'https://www.instagram.com/sherzod_kineziolog?igsh=ZWx3eTY0azNsNTl6&utm_source=qr'
 YOUTUBE_URL = 'https://youtube.com/@kineziomed_clinic?si=vTvHc9saAxjFJZpc'
 
+# Адрес Bot API (пустой - официальный api.telegram.org; для нагрузочных тестов - fake_bot_api.py,
+# например http://127.0.0.1:8081/bot)
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '')
+
+# Эндпоинт метрик Prometheus (/metrics): адрес и порт (0 - не запускать)
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Журнал трассировки обновлений (JSON-строка на обновление; пустой - не писать) и минимальная
+# длительность обработки, начиная с которой обновление попадает в журнал (мс)
+TRACE_LOG_FILE = os.getenv('TRACE_LOG_FILE', '')
+TRACE_MIN_DURATION_MS = float(os.getenv('TRACE_MIN_DURATION_MS', '0'))
+
+# Профилирование из админ-панели: длительность замера (сек) и число строк в отчете
+PROFILE_DURATION = int(os.getenv('PROFILE_DURATION', '30'))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '40'))
+
 # База данных
-DATABASE_FILE = 'medical_bot.db'
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'medical_bot.db')
+
+# Вопросов на одной странице /myquestions
+MY_QUESTIONS_PAGE_SIZE = int(os.getenv('MY_QUESTIONS_PAGE_SIZE', '5'))
+
+# Поиск /search: результатов на странице и сколько самых новых совпадений ранжировать
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5'))
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '5000'))
+
+# Похожие вопросы с готовыми ответами: порог сходства (0..1), сколько предлагать врачу
+# и сколько последних отвеченных вопросов держать в индексе (0 - выключено)
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.4'))
+SIMILARITY_MAX_SUGGESTIONS = int(os.getenv('SIMILARITY_MAX_SUGGESTIONS', '3'))
+SIMILARITY_INDEX_MAX_SIZE = int(os.getenv('SIMILARITY_INDEX_MAX_SIZE', '5000'))
+
+# Альбомы: сколько ждать следующий файл альбома и сколько максимум собирать альбом (мс)
+MEDIA_GROUP_WINDOW_MS = int(os.getenv('MEDIA_GROUP_WINDOW_MS', '1000'))
+MEDIA_GROUP_MAX_WAIT_MS = int(os.getenv('MEDIA_GROUP_MAX_WAIT_MS', '5000'))
+
+# Интервал сохранения user_data/chat_data/bot_data в базу (сек)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '5'))
+
+# Максимальное число обновлений, обрабатываемых одновременно (обновления одного пользователя - по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+# Настройки соединений SQLite (кэш страниц в КБ и размер mmap в байтах)
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+# Групповая запись вопросов и ответов: максимальный размер пачки и дополнительное ожидание
+# попутчиков перед коммитом (мс, 0 - коммитить сразу все, что накопилось в очереди)
+DB_GROUP_COMMIT_BATCH = int(os.getenv('DB_GROUP_COMMIT_BATCH', '100'))
+DB_GROUP_COMMIT_DELAY_MS = float(os.getenv('DB_GROUP_COMMIT_DELAY_MS', '0'))
+
+# Количество потоков для параллельного чтения из базы данных
+DB_READER_THREADS = int(os.getenv('DB_READER_THREADS', '4'))
+
+# Кэш проверки подписки на канал: время жизни положительного и отрицательного результата (сек) и размер
+SUBSCRIPTION_CACHE_TTL = int(os.getenv('SUBSCRIPTION_CACHE_TTL', '300'))
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = int(os.getenv('SUBSCRIPTION_CACHE_NEGATIVE_TTL', '30'))
+SUBSCRIPTION_CACHE_MAX_SIZE = int(os.getenv('SUBSCRIPTION_CACHE_MAX_SIZE', '10000'))
+
+# Кэш профилей пользователей: максимальный размер и интервал записи изменений в базу (сек)
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '50000'))
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', '5'))
+
+# Сверка участников канала на старте: пауза между запросами (сек), какие записи зеркала
+# считать устаревшими (часы) и сколько из них проверять за один запуск
+CHANNEL_RECONCILE_DELAY = float(os.getenv('CHANNEL_RECONCILE_DELAY', '0.05'))
+CHANNEL_RECONCILE_MAX_AGE_HOURS = float(os.getenv('CHANNEL_RECONCILE_MAX_AGE_HOURS', '24'))
+CHANNEL_RECONCILE_LIMIT = int(os.getenv('CHANNEL_RECONCILE_LIMIT', '1000'))
+
+# Максимальное количество одновременных отправок вопроса врачам
+DOCTOR_FANOUT_CONCURRENCY = int(os.getenv('DOCTOR_FANOUT_CONCURRENCY', '8'))
+
+# Лимиты исходящих сообщений: общий (сообщений/сек), на один чат (сообщений/сек и всплеск),
+# количество обработчиков очереди и число повторов после RetryAfter
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+OUTBOUND_PER_CHAT_RATE = float(os.getenv('OUTBOUND_PER_CHAT_RATE', '1'))
+OUTBOUND_PER_CHAT_BURST = int(os.getenv('OUTBOUND_PER_CHAT_BURST', '3'))
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '8'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+# Сколько секунд ожидания стоит одна ступень приоритета (защита подтверждений от голодания)
+OUTBOUND_PRIORITY_AGING = float(os.getenv('OUTBOUND_PRIORITY_AGING', '2'))
+
+# Отправлять ответы врачей голосом (0 - только текстом)
+TTS_ENABLED = os.getenv('TTS_ENABLED', '1') == '1'
+
+# Дисковый кэш голосовых ответов (TTS): каталог и максимальный размер в МБ
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', 'tts_cache')
+TTS_CACHE_MAX_MB = int(os.getenv('TTS_CACHE_MAX_MB', '200'))
+# Сколько file_id уже загруженных голосовых ответов хранить в базе (0 - без ограничения)
+TTS_CACHE_MAX_FILE_IDS = int(os.getenv('TTS_CACHE_MAX_FILE_IDS', '10000'))
+
+# Синтез длинных ответов: максимальная длина одной части (символов) и число потоков синтеза
+TTS_CHUNK_CHARS = int(os.getenv('TTS_CHUNK_CHARS', '500'))
+TTS_WORKERS = int(os.getenv('TTS_WORKERS', '4'))
 
+# Максимальное число задач синтеза в очереди сверх работающих и таймаут одной задачи (сек)
+TTS_MAX_QUEUE = int(os.getenv('TTS_MAX_QUEUE', '32'))
+TTS_TIMEOUT = float(os.getenv('TTS_TIMEOUT', '60'))
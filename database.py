@@ -1,23 +1,58 @@
+import re
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
+
+from group_commit import GroupCommitWriter
 
 logger = logging.getLogger(__name__)
 
-class Database:
-    def __init__(self, db_file):
-        self.db_file = db_file
-        self.init_db()
-    
-    def get_connection(self):
-        return sqlite3.connect(self.db_file, check_same_thread=False)
-    
-    def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+# Слова поискового запроса (апостроф - часть слова, как в токенизаторе search_index)
+SEARCH_TERM_RE = re.compile(r"[\w']+")
+
+# Маркеры начала и конца совпадения в сниппетах search_questions
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+# Пометки вместо текста для вопросов и ответов без текста (медиа, голосовые сообщения)
+MEDIA_PLACEHOLDER = 'Media-xabar'
+VOICE_PLACEHOLDER = 'Ovozli xabar'
+
+
+def _snippet(text, pattern, width):
+    """Фрагмент text длиной около width символов вокруг первого совпадения с отметками совпадений"""
+    if not text:
+        return ''
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 4) if match else 0
+    if start > 0:
+        # Не начинаем фрагмент с середины слова
+        space = text.find(' ', start)
+        start = space + 1 if 0 <= space < (match.start() if match else start + width) else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    fragment = pattern.sub(lambda m: SNIPPET_START + m.group(0) + SNIPPET_END, text[start:end])
+    return ('…' if start > 0 else '') + fragment + ('…' if end < len(text) else '')
+
+
+# Заполнение полнотекстового индекса из questions/answers (миграция 5 и rebuild_search_index)
+SEARCH_BACKFILL_SQL = '''
+    INSERT INTO search_index (rowid, question_text, answer_text)
+    SELECT q.question_id, q.question_text,
+           coalesce((SELECT group_concat(a.answer_text, ' ') FROM answers a WHERE a.question_id = q.question_id), '')
+    FROM questions q
+'''
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-команда или функция, принимающая курсор.
+# Номер последней примененной миграции хранится в PRAGMA user_version. Новые миграции
+# добавляются только в конец списка; уже выпущенные миграции не изменяются.
+MIGRATIONS = [
+    (1, 'Базовая схема', [
         # Таблица пользователей
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 username TEXT,
@@ -25,10 +60,9 @@ class Database:
                 role TEXT NOT NULL DEFAULT 'user',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
-        
+        ''',
         # Таблица вопросов от пользователей
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS questions (
                 question_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -38,10 +72,9 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
-        ''')
-        
+        ''',
         # Таблица ответов врачей
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS answers (
                 answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 question_id INTEGER NOT NULL,
@@ -52,18 +85,16 @@ class Database:
                 FOREIGN KEY (question_id) REFERENCES questions (question_id),
                 FOREIGN KEY (doctor_id) REFERENCES users (user_id)
             )
-        ''')
-        
+        ''',
         # Таблица настроек админа
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS admin_settings (
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL
             )
-        ''')
-        
+        ''',
         # Таблица подписок на социальные сети
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS social_subscriptions (
                 user_id INTEGER NOT NULL,
                 platform TEXT NOT NULL,
@@ -72,41 +103,338 @@ class Database:
                 PRIMARY KEY (user_id, platform),
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
-        ''')
+        ''',
+    ]),
+    (2, 'Зеркало участников канала, копии вопросов врачам, кэш голосовых ответов', [
+        # Локальное зеркало участников Telegram канала (обновляется по событиям chat_member)
+        '''
+            CREATE TABLE IF NOT EXISTS channel_members (
+                user_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        # Копии вопросов, разосланные врачам: (чат врача, ID сообщения) -> ID вопроса
+        '''
+            CREATE TABLE IF NOT EXISTS doctor_messages (
+                doctor_chat_id INTEGER NOT NULL,
+                doctor_message_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY (doctor_chat_id, doctor_message_id),
+                FOREIGN KEY (question_id) REFERENCES questions (question_id)
+            ) WITHOUT ROWID
+        ''',
+        # file_id голосовых сообщений, уже загруженных в Telegram (ключ - хэш текста и языка TTS)
+        '''
+            CREATE TABLE IF NOT EXISTS tts_voice_cache (
+                cache_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+    ]),
+    (3, 'Индексы для выборок вопросов, ответов и врачей', [
+        # Вопросы пользователя по дате (/myquestions)
+        'CREATE INDEX IF NOT EXISTS idx_questions_user_created ON questions (user_id, created_at)',
+        # Последний ответ на вопрос
+        'CREATE INDEX IF NOT EXISTS idx_answers_question_created ON answers (question_id, created_at)',
+        # Список врачей по дате добавления
+        'CREATE INDEX IF NOT EXISTS idx_users_role_created ON users (role, created_at)',
+    ]),
+    (4, 'Хранилище user_data/chat_data/bot_data', [
+        # Данные PTB в pickle: kind - 'user', 'chat' или 'bot', key - ID пользователя/чата (для bot - 0)
+        '''
+            CREATE TABLE IF NOT EXISTS persistent_data (
+                kind TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, 'Полнотекстовый поиск по вопросам и ответам', [
+        # Одна строка на вопрос (rowid = question_id): текст вопроса и всех ответов на него.
+        # Апостроф - часть слова (узбекская латиница: so'z, og'riq)
+        """
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                question_text,
+                answer_text,
+                tokenize = "unicode61 remove_diacritics 2 tokenchars ''''"
+            )
+        """,
+        # Индекс обновляется триггерами при любых изменениях вопросов и ответов
+        '''
+            CREATE TRIGGER IF NOT EXISTS questions_search_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO search_index (rowid, question_text, answer_text) VALUES (new.question_id, new.question_text, '');
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS questions_search_update AFTER UPDATE OF question_text ON questions BEGIN
+                UPDATE search_index SET question_text = new.question_text WHERE rowid = new.question_id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS questions_search_delete AFTER DELETE ON questions BEGIN
+                DELETE FROM search_index WHERE rowid = old.question_id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS answers_search_insert AFTER INSERT ON answers BEGIN
+                UPDATE search_index SET answer_text = ltrim(answer_text || ' ' || new.answer_text)
+                WHERE rowid = new.question_id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS answers_search_update AFTER UPDATE OF answer_text, question_id ON answers BEGIN
+                UPDATE search_index
+                SET answer_text = coalesce((
+                    SELECT group_concat(a.answer_text, ' ') FROM answers a WHERE a.question_id = search_index.rowid
+                ), '')
+                WHERE rowid IN (old.question_id, new.question_id);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS answers_search_delete AFTER DELETE ON answers BEGIN
+                UPDATE search_index
+                SET answer_text = coalesce((SELECT group_concat(answer_text, ' ') FROM answers WHERE question_id = old.question_id), '')
+                WHERE rowid = old.question_id;
+            END
+        ''',
+        # Индексируем уже существующие вопросы и ответы
+        SEARCH_BACKFILL_SQL,
+        "INSERT INTO search_index (search_index) VALUES ('optimize')",
+        # Совпадение в тексте вопроса весит вдвое больше, чем в ответах
+        "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+    ]),
+    (6, 'Время последнего использования file_id голосовых ответов', [
+        # Кэш file_id ограничен по числу записей: вытесняются давно не использованные
+        'ALTER TABLE tts_voice_cache ADD COLUMN last_used_at TIMESTAMP',
+        'UPDATE tts_voice_cache SET last_used_at = created_at',
+        'CREATE INDEX IF NOT EXISTS idx_tts_voice_cache_last_used ON tts_voice_cache (last_used_at)',
+    ]),
+]
+
+
+class Database:
+    def __init__(self, db_file, cache_size_kb=16384, mmap_size=268435456, busy_timeout=30.0,
+                 group_commit_batch=100, group_commit_delay=0.0):
+        self.db_file = db_file
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        
+        # Одно соединение на запись (под блокировкой) и по одному соединению на чтение на каждый поток
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        
+        # Вставки вопросов и ответов коммитятся пачками (см. GroupCommitWriter)
+        self.group_writer = GroupCommitWriter(self, max_batch=group_commit_batch, max_delay=group_commit_delay)
+        
+        # Список врачей в памяти: user_id -> {'user_id', 'username', 'full_name'}.
+        # Загружается при инициализации и обновляется при каждом изменении роли.
+        self._doctors = {}
+        self._doctors_lock = threading.Lock()
+        # Изменения списка врачей, которые применяются только после COMMIT внешней транзакции
+        self._on_commit = []
+        
+        self.init_db()
+    
+    def _connect(self):
+        """Открыть новое соединение и настроить его PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            isolation_level=None  # Транзакциями управляем сами (см. transaction())
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    def _get_writer(self):
+        """Соединение для записи (создается один раз)"""
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+    
+    def _get_reader(self):
+        """Соединение для чтения, закрепленное за текущим потоком"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция на запись: BEGIN IMMEDIATE ... COMMIT, при ошибке ROLLBACK.
+        
+        Вложенные вызовы в том же потоке присоединяются к внешней транзакции. Функции из
+        _on_commit вызываются после успешного COMMIT, а при откате отбрасываются.
+        """
+        with self._write_lock:
+            conn = self._get_writer()
+            if conn.in_transaction:
+                yield conn.cursor()
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                self._on_commit = []
+                raise
+            else:
+                try:
+                    conn.commit()
+                finally:
+                    on_commit, self._on_commit = self._on_commit, []
+                for apply in on_commit:
+                    apply()
+    
+    @contextmanager
+    def reader(self):
+        """Курсор для чтения. В режиме WAL чтение не блокируется записью."""
+        cursor = self._get_reader().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    
+    def close(self):
+        """Записать операции из очереди групповой записи и закрыть все открытые соединения"""
+        self.group_writer.close()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.debug(f"Не удалось закрыть соединение: {e}")
+        self._writer = None
+        self._local = threading.local()
+    
+    def init_db(self):
+        """Инициализация базы данных: применение миграций схемы"""
+        self.migrate()
         
         # Устанавливаем пароль по умолчанию, если его нет
-        cursor.execute('SELECT * FROM admin_settings WHERE key = ?', ('admin_password',))
-        if not cursor.fetchone():
-            cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', 'admin123'))
+        with self.transaction() as cursor:
+            cursor.execute('SELECT * FROM admin_settings WHERE key = ?', ('admin_password',))
+            if not cursor.fetchone():
+                cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', 'admin123'))
         
-        conn.commit()
-        conn.close()
+        self._load_doctors()
         logger.info("База данных инициализирована")
     
+    def schema_version(self):
+        """Текущая версия схемы (PRAGMA user_version)"""
+        with self.reader() as cursor:
+            cursor.execute('PRAGMA user_version')
+            return cursor.fetchone()[0]
+    
+    def migrate(self):
+        """Применить недостающие миграции из MIGRATIONS.
+        
+        Каждая миграция выполняется в отдельной транзакции вместе с обновлением
+        PRAGMA user_version, поэтому схема никогда не остается в промежуточном состоянии.
+        """
+        for version, description, steps in MIGRATIONS:
+            with self.transaction() as cursor:
+                # Версию читаем внутри транзакции: другой процесс мог уже применить миграцию
+                cursor.execute('PRAGMA user_version')
+                if cursor.fetchone()[0] >= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f'PRAGMA user_version = {int(version)}')
+            logger.info(f"Применена миграция {version}: {description}")
+    
+    def _load_doctors(self):
+        """Загрузить список врачей из базы в память"""
+        with self.reader() as cursor:
+            cursor.execute('SELECT user_id, username, full_name FROM users WHERE role = ?', ('doctor',))
+            results = cursor.fetchall()
+        with self._doctors_lock:
+            self._doctors = {r[0]: {'user_id': r[0], 'username': r[1], 'full_name': r[2]} for r in results}
+        logger.info(f"Загружено врачей: {len(self._doctors)}")
+    
+    def _update_doctor(self, cursor, user_id):
+        """Обновить запись врача в памяти по текущему состоянию строки users (после COMMIT)"""
+        cursor.execute('SELECT username, full_name, role FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        doctor = None
+        if result and result[2] == 'doctor':
+            doctor = {'user_id': user_id, 'username': result[0], 'full_name': result[1]}
+        
+        def apply():
+            with self._doctors_lock:
+                if doctor:
+                    self._doctors[user_id] = doctor
+                else:
+                    self._doctors.pop(user_id, None)
+        self._on_commit.append(apply)
+    
+    def _clear_doctors(self):
+        with self._doctors_lock:
+            self._doctors = {}
+    
+    def is_doctor(self, user_id):
+        """Является ли пользователь врачом (без обращения к базе)"""
+        with self._doctors_lock:
+            return user_id in self._doctors
+    
     def add_user(self, user_id, username, full_name, role='user'):
         """Добавить пользователя в базу данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, full_name, role)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, full_name, role))
-            conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO users (user_id, username, full_name, role)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, username, full_name, role))
+                if role == 'doctor' and cursor.rowcount > 0:
+                    self._update_doctor(cursor, user_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении пользователя: {e}")
             return False
-        finally:
-            conn.close()
+    
+    def upsert_users(self, users):
+        """Добавить или обновить профили пользователей пачкой: [(user_id, username, full_name), ...].
+        
+        Роль существующих пользователей не меняется.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO users (user_id, username, full_name)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    full_name = excluded.full_name
+                WHERE username IS NOT excluded.username OR full_name IS NOT excluded.full_name
+            ''', users)
+        with self._doctors_lock:
+            for user_id, username, full_name in users:
+                if user_id in self._doctors:
+                    self._doctors[user_id] = {'user_id': user_id, 'username': username, 'full_name': full_name}
     
     def get_user(self, user_id):
         """Получить информацию о пользователе"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
         if result:
             return {
                 'user_id': result[0],
@@ -119,32 +447,31 @@ class Database:
     
     def set_user_role(self, user_id, role):
         """Установить роль пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', (role, user_id))
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', (role, user_id))
+            self._update_doctor(cursor, user_id)
     
-    def add_question(self, user_id, message_id, question_text):
-        """Добавить вопрос от пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @staticmethod
+    def _insert_question(cursor, user_id, message_id, question_text):
         cursor.execute('''
             INSERT INTO questions (user_id, message_id, question_text)
             VALUES (?, ?, ?)
         ''', (user_id, message_id, question_text))
-        question_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return question_id
+        return cursor.lastrowid
+    
+    def submit_question(self, user_id, message_id, question_text):
+        """Поставить вопрос в очередь групповой записи. Возвращает Future с ID вопроса."""
+        return self.group_writer.submit(self._insert_question, user_id, message_id, question_text)
+    
+    def add_question(self, user_id, message_id, question_text):
+        """Добавить вопрос от пользователя"""
+        return self.submit_question(user_id, message_id, question_text).result()
     
     def get_question(self, question_id):
         """Получить вопрос по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM questions WHERE question_id = ?', (question_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT * FROM questions WHERE question_id = ?', (question_id,))
+            result = cursor.fetchone()
         if result:
             return {
                 'question_id': result[0],
@@ -156,10 +483,8 @@ class Database:
             }
         return None
     
-    def add_answer(self, question_id, doctor_id, message_id, answer_text):
-        """Добавить ответ врача"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @staticmethod
+    def _insert_answer(cursor, question_id, doctor_id, message_id, answer_text):
         cursor.execute('''
             INSERT INTO answers (question_id, doctor_id, message_id, answer_text)
             VALUES (?, ?, ?, ?)
@@ -167,26 +492,64 @@ class Database:
         answer_id = cursor.lastrowid
         # Обновляем статус вопроса
         cursor.execute('UPDATE questions SET status = ? WHERE question_id = ?', ('answered', question_id))
-        conn.commit()
-        conn.close()
         return answer_id
     
+    def submit_answer(self, question_id, doctor_id, message_id, answer_text):
+        """Поставить ответ врача в очередь групповой записи. Возвращает Future с ID ответа."""
+        return self.group_writer.submit(self._insert_answer, question_id, doctor_id, message_id, answer_text)
+    
+    def add_answer(self, question_id, doctor_id, message_id, answer_text):
+        """Добавить ответ врача"""
+        return self.submit_answer(question_id, doctor_id, message_id, answer_text).result()
+    
+    def claim_question(self, question_id):
+        """Атомарно отметить вопрос отвеченным. False, если на него уже ответили (или его нет)."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE questions SET status = 'answered' WHERE question_id = ? AND status IS NOT 'answered'",
+                (question_id,)
+            )
+            return cursor.rowcount == 1
+    
+    def release_question(self, question_id):
+        """Вернуть занятый claim_question вопрос в ожидание, если ответ на него так и не записан"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE questions SET status = 'pending'
+                WHERE question_id = ? AND status = 'answered'
+                AND NOT EXISTS (SELECT 1 FROM answers WHERE answers.question_id = questions.question_id)
+            ''', (question_id,))
+            return cursor.rowcount == 1
+    
+    def add_doctor_messages(self, question_id, messages):
+        """Запомнить копии вопроса, отправленные врачам: список пар (doctor_chat_id, doctor_message_id)"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO doctor_messages (doctor_chat_id, doctor_message_id, question_id)
+                VALUES (?, ?, ?)
+            ''', [(chat_id, message_id, question_id) for chat_id, message_id in messages])
+        return True
+    
+    def get_question_id_by_doctor_message(self, doctor_chat_id, doctor_message_id):
+        """Получить ID вопроса по сообщению, отправленному врачу"""
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT question_id FROM doctor_messages
+                WHERE doctor_chat_id = ? AND doctor_message_id = ?
+            ''', (doctor_chat_id, doctor_message_id))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
     def get_all_doctors(self):
-        """Получить список всех врачей"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, username, full_name FROM users WHERE role = ?', ('doctor',))
-        results = cursor.fetchall()
-        conn.close()
-        return [{'user_id': r[0], 'username': r[1], 'full_name': r[2]} for r in results]
+        """Получить список всех врачей (из памяти, без обращения к базе)"""
+        with self._doctors_lock:
+            return [dict(doctor) for doctor in self._doctors.values()]
     
     def get_question_by_message_id(self, user_id, message_id):
         """Получить вопрос по ID сообщения и пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM questions WHERE user_id = ? AND message_id = ?', (user_id, message_id))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT * FROM questions WHERE user_id = ? AND message_id = ?', (user_id, message_id))
+            result = cursor.fetchone()
         if result:
             return {
                 'question_id': result[0],
@@ -200,17 +563,15 @@ class Database:
     
     def get_user_questions(self, user_id, limit=10):
         """Получить вопросы пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT question_id, question_text, status, created_at 
-            FROM questions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        results = cursor.fetchall()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT question_id, question_text, status, created_at
+                FROM questions
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+            ''', (user_id, limit))
+            results = cursor.fetchall()
         return [
             {
                 'question_id': r[0],
@@ -221,20 +582,148 @@ class Database:
             for r in results
         ]
     
+    def get_user_questions_page(self, user_id, limit=5, older_than=None, newer_than=None):
+        """Страница вопросов пользователя вместе с последним ответом на каждый.
+        
+        Пагинация по ключу (created_at, question_id): older_than/newer_than - question_id
+        последнего/первого вопроса текущей страницы. Индекс idx_questions_user_created хранит
+        rowid (question_id) последним столбцом, поэтому страница читается из индекса без
+        сортировки и без OFFSET. Возвращает вопросы от новых к старым и флаги has_older/has_newer.
+        """
+        if newer_than is not None:
+            condition, order, cursor_id = '>', 'ASC', newer_than
+        else:
+            condition, order, cursor_id = '<', 'DESC', older_than
+        cursor_filter = (
+            f'AND (q.created_at, q.question_id) {condition} '
+            '(SELECT created_at, question_id FROM questions WHERE question_id = ?)'
+            if cursor_id is not None else ''
+        )
+        params = [user_id] + ([cursor_id] if cursor_id is not None else []) + [limit + 1]
+        with self.reader() as cursor:
+            cursor.execute(f'''
+                SELECT q.question_id, q.question_text, q.status, q.created_at,
+                       a.answer_text, a.created_at, d.full_name, d.username
+                FROM questions q
+                LEFT JOIN answers a ON a.answer_id = (
+                    SELECT a2.answer_id FROM answers a2
+                    WHERE a2.question_id = q.question_id
+                    ORDER BY a2.created_at DESC, a2.answer_id DESC
+                    LIMIT 1
+                )
+                LEFT JOIN users d ON d.user_id = a.doctor_id
+                WHERE q.user_id = ? {cursor_filter}
+                ORDER BY q.created_at {order}, q.question_id {order}
+                LIMIT ?
+            ''', params)
+            results = cursor.fetchall()
+        
+        has_more = len(results) > limit
+        results = results[:limit]
+        if newer_than is not None:
+            results.reverse()
+        questions = [
+            {
+                'question_id': r[0],
+                'question_text': r[1],
+                'status': r[2],
+                'created_at': r[3],
+                'answer': {
+                    'answer_text': r[4],
+                    'created_at': r[5],
+                    'doctor_name': r[6] or r[7] or 'Врач'
+                } if r[4] is not None else None
+            }
+            for r in results
+        ]
+        return {
+            'questions': questions,
+            'has_older': has_more if newer_than is None else True,
+            'has_newer': has_more if newer_than is not None else older_than is not None
+        }
+    
+    @staticmethod
+    def _search_terms(query):
+        """Слова поискового запроса в нижнем регистре (не больше 16)"""
+        terms = [term.strip("'") for term in SEARCH_TERM_RE.findall(query.lower())]
+        return [term for term in terms if term][:16]
+    
+    def search_questions(self, query, limit=5, offset=0, max_candidates=5000):
+        """Полнотекстовый поиск по вопросам и ответам, лучшие совпадения первыми.
+        
+        Все слова запроса обязательны, каждое ищется как префикс. bm25 считается только для
+        max_candidates самых новых совпадений: для частых слов ранжирование всех сотен тысяч
+        совпадений заняло бы сотни миллисекунд, а старые вопросы врачам обычно не нужны.
+        Сниппеты строятся по тексту из индекса, совпадения отмечены SNIPPET_START/SNIPPET_END.
+        Возвращает {'results': [...], 'has_more': bool}.
+        """
+        terms = self._search_terms(query)
+        if not terms:
+            return {'results': [], 'has_more': False}
+        expression = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+        
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT rowid FROM (
+                    SELECT rowid, rank FROM search_index
+                    WHERE search_index MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                )
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ''', (expression, max_candidates, limit + 1, offset))
+            ids = [r[0] for r in cursor.fetchall()]
+            has_more = len(ids) > limit
+            ids = ids[:limit]
+            if not ids:
+                return {'results': [], 'has_more': False}
+            placeholders = ','.join('?' * len(ids))
+            cursor.execute(f'''
+                SELECT s.rowid, s.question_text, s.answer_text, q.status, q.created_at
+                FROM search_index s
+                JOIN questions q ON q.question_id = s.rowid
+                WHERE s.rowid IN ({placeholders})
+            ''', ids)
+            rows = {r[0]: r for r in cursor.fetchall()}
+        
+        pattern = re.compile(
+            r"(?<![\w'])(?:" + '|'.join(re.escape(term) for term in terms) + r")[\w']*", re.IGNORECASE
+        )
+        return {
+            'results': [
+                {
+                    'question_id': question_id,
+                    'question_snippet': _snippet(rows[question_id][1], pattern, 120),
+                    'answer_snippet': _snippet(rows[question_id][2], pattern, 240),
+                    'status': rows[question_id][3],
+                    'created_at': rows[question_id][4]
+                }
+                for question_id in ids if question_id in rows
+            ],
+            'has_more': has_more
+        }
+    
+    def rebuild_search_index(self):
+        """Заново заполнить полнотекстовый индекс из questions/answers"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM search_index')
+            cursor.execute(SEARCH_BACKFILL_SQL)
+            cursor.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        logger.info("Поисковый индекс перестроен")
+    
     def get_answer_for_question(self, question_id):
         """Получить ответ на вопрос"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT a.answer_text, a.created_at, u.full_name, u.username
-            FROM answers a
-            JOIN users u ON a.doctor_id = u.user_id
-            WHERE a.question_id = ?
-            ORDER BY a.created_at DESC
-            LIMIT 1
-        ''', (question_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT a.answer_text, a.created_at, u.full_name, u.username
+                FROM answers a
+                JOIN users u ON a.doctor_id = u.user_id
+                WHERE a.question_id = ?
+                ORDER BY a.created_at DESC
+                LIMIT 1
+            ''', (question_id,))
+            result = cursor.fetchone()
         if result:
             return {
                 'answer_text': result[0],
@@ -243,56 +732,95 @@ class Database:
             }
         return None
     
+    def get_questions_with_answers(self, question_ids):
+        """Тексты вопросов и их последних ответов одним запросом: question_id -> словарь"""
+        if not question_ids:
+            return {}
+        placeholders = ','.join('?' * len(question_ids))
+        with self.reader() as cursor:
+            cursor.execute(f'''
+                SELECT q.question_id, q.question_text, a.answer_text
+                FROM questions q
+                JOIN answers a ON a.answer_id = (
+                    SELECT answer_id FROM answers
+                    WHERE question_id = q.question_id
+                    ORDER BY created_at DESC, answer_id DESC
+                    LIMIT 1
+                )
+                WHERE q.question_id IN ({placeholders})
+            ''', list(question_ids))
+            results = cursor.fetchall()
+        return {
+            row[0]: {'question_text': row[1], 'answer_text': row[2]}
+            for row in results
+        }
+    
+    def get_answered_questions(self, limit=20000):
+        """Последние вопросы с текстовым ответом врача: список (question_id, question_text) от старых к новым.
+        
+        Вопросы без текста и ответы голосом/медиа (в базе хранится только пометка) пропускаются -
+        их нельзя предложить врачу для повторного ответа.
+        """
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT question_id, question_text
+                FROM questions q
+                WHERE q.status = 'answered'
+                  AND q.question_text != ?
+                  AND EXISTS (
+                      SELECT 1 FROM answers a
+                      WHERE a.question_id = q.question_id AND a.answer_text NOT IN (?, ?)
+                  )
+                ORDER BY q.question_id DESC
+                LIMIT ?
+            ''', (MEDIA_PLACEHOLDER, MEDIA_PLACEHOLDER, VOICE_PLACEHOLDER, limit))
+            results = cursor.fetchall()
+        results.reverse()
+        return results
+    
     def add_doctor(self, user_id, username=None, full_name=None):
         """Добавить врача в базу данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            # Сначала проверяем, существует ли пользователь
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Обновляем роль существующего пользователя
-                cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', ('doctor', user_id))
-                if username or full_name:
-                    cursor.execute('UPDATE users SET username = COALESCE(?, username), full_name = COALESCE(?, full_name) WHERE user_id = ?', 
-                                (username, full_name, user_id))
-            else:
-                # Создаем нового пользователя с ролью врача
-                cursor.execute('''
-                    INSERT INTO users (user_id, username, full_name, role)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, username, full_name, 'doctor'))
-            conn.commit()
+            with self.transaction() as cursor:
+                # Сначала проверяем, существует ли пользователь
+                cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+                existing = cursor.fetchone()
+                
+                if existing:
+                    # Обновляем роль существующего пользователя
+                    cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', ('doctor', user_id))
+                    if username or full_name:
+                        cursor.execute('UPDATE users SET username = COALESCE(?, username), full_name = COALESCE(?, full_name) WHERE user_id = ?',
+                                    (username, full_name, user_id))
+                else:
+                    # Создаем нового пользователя с ролью врача
+                    cursor.execute('''
+                        INSERT INTO users (user_id, username, full_name, role)
+                        VALUES (?, ?, ?, ?)
+                    ''', (user_id, username, full_name, 'doctor'))
+                self._update_doctor(cursor, user_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении врача: {e}")
             return False
-        finally:
-            conn.close()
     
     def remove_doctor(self, user_id):
         """Удалить врача (изменить роль на user)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('UPDATE users SET role = ? WHERE user_id = ? AND role = ?', ('user', user_id, 'doctor'))
-            conn.commit()
-            return cursor.rowcount > 0
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE users SET role = ? WHERE user_id = ? AND role = ?', ('user', user_id, 'doctor'))
+                removed = cursor.rowcount > 0
+                self._update_doctor(cursor, user_id)
+            return removed
         except Exception as e:
             logger.error(f"Ошибка при удалении врача: {e}")
             return False
-        finally:
-            conn.close()
     
     def get_doctor(self, user_id):
         """Получить информацию о враче"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ? AND role = ?', (user_id, 'doctor'))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT * FROM users WHERE user_id = ? AND role = ?', (user_id, 'doctor'))
+            result = cursor.fetchone()
         if result:
             return {
                 'user_id': result[0],
@@ -305,11 +833,9 @@ class Database:
     
     def list_all_doctors(self):
         """Получить полный список всех врачей с подробной информацией"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, username, full_name, created_at FROM users WHERE role = ? ORDER BY created_at DESC', ('doctor',))
-        results = cursor.fetchall()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT user_id, username, full_name, created_at FROM users WHERE role = ? ORDER BY created_at DESC', ('doctor',))
+            results = cursor.fetchall()
         return [
             {
                 'user_id': r[0],
@@ -322,52 +848,41 @@ class Database:
     
     def get_admin_password(self):
         """Получить пароль админа"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM admin_settings WHERE key = ?', ('admin_password',))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('SELECT value FROM admin_settings WHERE key = ?', ('admin_password',))
+            result = cursor.fetchone()
         return result[0] if result else 'admin123'
     
     def set_admin_password(self, new_password):
         """Установить новый пароль админа"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO admin_settings (key, value)
-            VALUES (?, ?)
-        ''', ('admin_password', new_password))
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO admin_settings (key, value)
+                VALUES (?, ?)
+            ''', ('admin_password', new_password))
         return True
     
     def set_social_subscription(self, user_id, platform, subscribed=True):
         """Установить статус подписки на социальную сеть"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO social_subscriptions (user_id, platform, subscribed, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, platform, 1 if subscribed else 0))
-            conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO social_subscriptions (user_id, platform, subscribed, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, platform, 1 if subscribed else 0))
             return True
         except Exception as e:
             logger.error(f"Ошибка при установке подписки на {platform}: {e}")
             return False
-        finally:
-            conn.close()
     
     def get_social_subscription(self, user_id, platform):
         """Получить статус подписки на социальную сеть"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT subscribed FROM social_subscriptions 
-            WHERE user_id = ? AND platform = ?
-        ''', (user_id, platform))
-        result = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT subscribed FROM social_subscriptions
+                WHERE user_id = ? AND platform = ?
+            ''', (user_id, platform))
+            result = cursor.fetchone()
         return result[0] == 1 if result else False
     
     def check_all_subscriptions(self, user_id):
@@ -377,57 +892,173 @@ class Database:
             'youtube': self.get_social_subscription(user_id, 'youtube')
         }
     
+    def set_channel_member(self, user_id, status):
+        """Сохранить статус участника канала"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO channel_members (user_id, status, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (user_id, status))
+        return True
+    
+    def set_channel_members(self, members):
+        """Сохранить статусы нескольких участников канала: список пар (user_id, status)"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO channel_members (user_id, status, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', members)
+        return True
+    
+    def get_channel_member_status(self, user_id):
+        """Получить статус участника канала из локального зеркала (None, если пользователь не встречался)"""
+        with self.reader() as cursor:
+            cursor.execute('SELECT status FROM channel_members WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def list_stale_channel_members(self, max_age, limit):
+        """Участники зеркала, чей статус не обновлялся дольше max_age секунд (самые старые первыми).
+        
+        Возвращает список пар (user_id, updated_at); updated_at нужен для
+        update_channel_members_if_unchanged.
+        """
+        with self.reader() as cursor:
+            cursor.execute('''
+                SELECT user_id, updated_at
+                FROM channel_members
+                WHERE updated_at < datetime('now', ?)
+                ORDER BY updated_at
+                LIMIT ?
+            ''', (f'-{int(max_age)} seconds', limit))
+            return cursor.fetchall()
+    
+    def update_channel_members_if_unchanged(self, members):
+        """Сохранить статусы (status, user_id, updated_at), полученные при сверке.
+        
+        Статус записывается, только если запись не менялась с момента чтения (updated_at
+        тот же): более новый статус из события chat_member не затирается. Возвращает
+        число обновленных записей.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE channel_members SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ? AND updated_at = ?
+            ''', members)
+            return cursor.rowcount
+    
+    def get_tts_file_id(self, cache_key):
+        """Получить file_id голосового сообщения для ключа TTS"""
+        with self.reader() as cursor:
+            cursor.execute('SELECT file_id FROM tts_voice_cache WHERE cache_key = ?', (cache_key,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def set_tts_file_id(self, cache_key, file_id, max_entries=None):
+        """Сохранить file_id голосового сообщения для ключа TTS.
+        
+        Если задан max_entries, давно не использованные записи сверх этого числа удаляются.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO tts_voice_cache (cache_key, file_id, last_used_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    last_used_at = excluded.last_used_at
+            ''', (cache_key, file_id))
+            if max_entries:
+                cursor.execute('''
+                    DELETE FROM tts_voice_cache WHERE cache_key IN (
+                        SELECT cache_key FROM tts_voice_cache
+                        ORDER BY last_used_at DESC, rowid DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                ''', (max_entries,))
+        return True
+    
+    def touch_tts_file_id(self, cache_key):
+        """Отметить повторное использование file_id (чтобы его не вытеснили)"""
+        with self.transaction() as cursor:
+            cursor.execute(
+                'UPDATE tts_voice_cache SET last_used_at = CURRENT_TIMESTAMP WHERE cache_key = ?', (cache_key,)
+            )
+    
+    def delete_tts_file_id(self, cache_key):
+        """Удалить недействительный file_id голосового сообщения"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM tts_voice_cache WHERE cache_key = ?', (cache_key,))
+        return True
+    
+    def get_persistent_data(self, kind, key):
+        """Получить сохраненные данные PTB (pickle) или None"""
+        with self.reader() as cursor:
+            cursor.execute('SELECT data FROM persistent_data WHERE kind = ? AND key = ?', (kind, key))
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    def set_persistent_data(self, kind, key, data):
+        """Сохранить данные PTB (pickle) одного пользователя, чата или бота"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO persistent_data (kind, key, data, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', (kind, key, data))
+        return True
+    
+    def delete_persistent_data(self, kind, key):
+        """Удалить сохраненные данные PTB"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM persistent_data WHERE kind = ? AND key = ?', (kind, key))
+        return True
+    
     def clear_all_data(self, keep_admin_settings=True):
         """Очистить все данные из базы данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
             # Сохраняем пароль админа, если нужно
             admin_password = None
             if keep_admin_settings:
                 admin_password = self.get_admin_password()
             
-            # Очищаем все таблицы
-            cursor.execute('DELETE FROM answers')
-            cursor.execute('DELETE FROM questions')
-            cursor.execute('DELETE FROM users')
-            
-            # Если нужно сохранить настройки админа, восстанавливаем пароль
-            if keep_admin_settings and admin_password:
-                cursor.execute('DELETE FROM admin_settings')
-                cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', admin_password))
+            with self.transaction() as cursor:
+                # Очищаем все таблицы (поисковый индекс - первым, чтобы триггеры не обновляли его построчно)
+                cursor.execute('DELETE FROM search_index')
+                cursor.execute('DELETE FROM doctor_messages')
+                cursor.execute('DELETE FROM answers')
+                cursor.execute('DELETE FROM questions')
+                cursor.execute('DELETE FROM users')
+                self._on_commit.append(self._clear_doctors)
+                
+                # Если нужно сохранить настройки админа, восстанавливаем пароль
+                if keep_admin_settings and admin_password:
+                    cursor.execute('DELETE FROM admin_settings')
+                    cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', admin_password))
             
-            conn.commit()
             logger.info("База данных очищена")
             return True
         except Exception as e:
             logger.error(f"Ошибка при очистке базы данных: {e}")
-            conn.rollback()
             return False
-        finally:
-            conn.close()
     
     def clear_database_completely(self):
         """Полностью очистить базу данных (включая настройки админа)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            # Очищаем все таблицы
-            cursor.execute('DELETE FROM answers')
-            cursor.execute('DELETE FROM questions')
-            cursor.execute('DELETE FROM users')
-            cursor.execute('DELETE FROM admin_settings')
-            
-            # Восстанавливаем пароль по умолчанию
-            cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', 'admin123'))
+            with self.transaction() as cursor:
+                # Очищаем все таблицы (поисковый индекс - первым, чтобы триггеры не обновляли его построчно)
+                cursor.execute('DELETE FROM search_index')
+                cursor.execute('DELETE FROM doctor_messages')
+                cursor.execute('DELETE FROM answers')
+                cursor.execute('DELETE FROM questions')
+                cursor.execute('DELETE FROM users')
+                self._on_commit.append(self._clear_doctors)
+                cursor.execute('DELETE FROM admin_settings')
+                
+                # Восстанавливаем пароль по умолчанию
+                cursor.execute('INSERT INTO admin_settings (key, value) VALUES (?, ?)', ('admin_password', 'admin123'))
             
-            conn.commit()
             logger.info("База данных полностью очищена")
             return True
         except Exception as e:
             logger.error(f"Ошибка при полной очистке базы данных: {e}")
-            conn.rollback()
             return False
-        finally:
-            conn.close()
-
@@ -0,0 +1,302 @@
+"""Локальная замена Telegram Bot API для нагрузочного тестирования.
+
+Реализует методы, которые использует бот (getUpdates, sendMessage, sendPhoto, sendVoice,
+getChatMember, createChatInviteLink и др.), с настраиваемой задержкой ответа и
+случайными ошибками 429 (RetryAfter). Бот подключается к серверу через BOT_API_BASE_URL.
+
+Самостоятельный запуск (обновления добавляются через POST /control/updates):
+
+    python fake_bot_api.py --port 8081 --latency-ms 30 --rate-limit-prob 0.01
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot BOT_TOKEN=123:fake python bot.py
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_medical_bot'}
+
+# Методы, которые отправляют сообщение и возвращают Message
+SEND_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendVoice', 'sendVideo', 'sendDocument', 'sendAudio',
+    'sendLocation', 'copyMessage', 'forwardMessage',
+})
+
+
+def parse_body(content_type, body):
+    """Параметры запроса PTB: form-urlencoded или multipart (значения - JSON или строки)"""
+    params = {}
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = {'file': part.get_filename(), 'size': len(part.get_payload(decode=True) or b'')}
+            else:
+                params[name] = part.get_content()
+    else:
+        params = dict(urllib.parse.parse_qsl(body.decode('utf-8')))
+    for name, value in params.items():
+        if isinstance(value, str):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+class FakeBotAPI:
+    """Сервер Bot API в отдельном потоке.
+    
+    on_call(method, params, result) вызывается после каждого успешного запроса, а
+    on_updates(updates) - при выдаче обновлений боту (оба - из потока сервера). Через них
+    нагрузочный тест отслеживает ответы бота.
+    """
+    
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0, rate_limit_prob=0.0, retry_after=1,
+                 on_call=None, on_updates=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.on_call = on_call
+        self.on_updates = on_updates
+        self.calls = Counter()
+        self.rate_limited = 0
+        self.ready = threading.Event()  # бот сделал первый getUpdates
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._stopped = False
+    
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+    
+    def start(self):
+        """Запустить сервер в фоновом потоке"""
+        api = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело пишутся отдельно - без TCP_NODELAY каждый ответ ждал бы delayed ACK
+            disable_nagle_algorithm = True
+            
+            def do_POST(self):
+                api._handle(self)
+            
+            do_GET = do_POST
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Bot API слушает {self.base_url}")
+    
+    def stop(self):
+        """Остановить сервер"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+    
+    def push_update(self, update):
+        """Добавить обновление в очередь getUpdates. Возвращает присвоенный update_id."""
+        with self._cond:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update['update_id']
+    
+    def next_message_id(self):
+        return next(self._message_ids)
+    
+    def stats(self):
+        """Счетчики вызовов по методам"""
+        with self._stats_lock:
+            return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()), 'rate_limited': self.rate_limited}
+    
+    def _respond(self, handler, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        try:
+            handler.send_response(status)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        except ConnectionError:
+            # Клиент (бот) закрыл соединение, например при остановке
+            pass
+    
+    def _handle(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        path = urllib.parse.urlparse(handler.path).path
+        
+        if path.startswith('/control/'):
+            self._control(handler, path, body)
+            return
+        
+        # /bot<token>/<method>
+        method = path.rsplit('/', 1)[-1]
+        try:
+            params = parse_body(handler.headers.get('Content-Type', ''), body)
+        except ValueError:
+            self._respond(handler, 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid body'})
+            return
+        
+        if method != 'getUpdates':
+            if self.latency:
+                time.sleep(self.latency)
+            if self.rate_limit_prob and method in SEND_METHODS and random.random() < self.rate_limit_prob:
+                with self._stats_lock:
+                    self.rate_limited += 1
+                self._respond(handler, 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after}
+                })
+                return
+        
+        with self._stats_lock:
+            self.calls[method] += 1
+        result = self._call(method, params)
+        self._respond(handler, 200, {'ok': True, 'result': result})
+        if self.on_call is not None and method != 'getUpdates':
+            self.on_call(method, params, result)
+    
+    def _control(self, handler, path, body):
+        if path == '/control/updates':
+            data = json.loads(body or b'[]')
+            ids = [self.push_update(update) for update in (data if isinstance(data, list) else [data])]
+            self._respond(handler, 200, {'ok': True, 'result': ids})
+        elif path == '/control/stats':
+            self._respond(handler, 200, {'ok': True, 'result': self.stats()})
+        else:
+            self._respond(handler, 404, {'ok': False, 'description': 'Not Found'})
+    
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        self.ready.set()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Подтвержденные обновления (update_id < offset) удаляются
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    break
+                self._cond.wait(remaining)
+            updates = self._updates[:limit]
+        if updates and self.on_updates is not None:
+            self.on_updates(updates)
+        return updates
+    
+    def _message(self, params, **fields):
+        chat_id = params.get('chat_id')
+        message = {
+            'message_id': self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        message.update(fields)
+        return message
+    
+    def _call(self, method, params):
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getMe':
+            return dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+        if method == 'deleteWebhook':
+            if params.get('drop_pending_updates'):
+                with self._cond:
+                    self._updates = []
+            return True
+        if method == 'getChatMember':
+            user_id = int(params.get('user_id'))
+            return {'status': 'member', 'user': {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}}
+        if method == 'getChatAdministrators':
+            return []
+        if method == 'getChat':
+            return {'id': -1001000000000, 'type': 'channel', 'title': 'Fake channel', 'username': str(params.get('chat_id', '')).lstrip('@')}
+        if method == 'createChatInviteLink':
+            return {
+                'invite_link': f"https://t.me/+fake{self.next_message_id()}",
+                'creator': BOT_USER,
+                'creates_join_request': False,
+                'is_primary': False,
+                'is_revoked': False,
+                'member_limit': params.get('member_limit')
+            }
+        if method == 'sendMessage':
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendVoice':
+            file_id = f"voice{self.next_message_id()}"
+            return self._message(params, caption=params.get('caption'), voice={
+                'file_id': file_id, 'file_unique_id': file_id, 'duration': 1
+            })
+        if method in ('sendPhoto', 'sendVideo', 'sendDocument', 'sendAudio'):
+            return self._message(params, caption=params.get('caption'))
+        if method == 'sendLocation':
+            return self._message(params, location={'latitude': params.get('latitude'), 'longitude': params.get('longitude')})
+        if method == 'copyMessage':
+            return {'message_id': self.next_message_id()}
+        if method == 'forwardMessage':
+            return self._message(params)
+        if method == 'sendMediaGroup':
+            media = params.get('media') or []
+            return [self._message(params, caption=item.get('caption')) for item in media]
+        # setMyCommands, setMyDescription, deleteMessage, answerCallbackQuery и т.п.
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="задержка ответа на каждый запрос")
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    api = FakeBotAPI(args.host, args.port, args.latency_ms / 1000, args.rate_limit_prob, args.retry_after)
+    api.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
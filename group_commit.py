@@ -0,0 +1,127 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Признак остановки потока записи
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Групповая запись: вставки из разных обработчиков коммитятся одной транзакцией.
+    
+    Операция - функция op(cursor, *args), ее результат (например, lastrowid) возвращается
+    вызывающему через Future. В пачку попадает все, что уже накопилось в очереди (не больше
+    max_batch операций), и она сразу коммитится: операции, пришедшие во время коммита,
+    составят следующую пачку. Одиночная запись не ждет таймера - в WAL с synchronous=NORMAL
+    коммит дешевый. max_delay > 0 дополнительно ждет попутчиков после первой операции.
+    Каждая операция выполняется в своем SAVEPOINT, поэтому ошибка одной операции
+    не откатывает остальные.
+    """
+    
+    def __init__(self, database, max_batch=100, max_delay=0.0):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self.max_batch_seen = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+    
+    def submit(self, op, *args):
+        """Поставить операцию в очередь. Возвращает concurrent.futures.Future с ее результатом."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Групповая запись остановлена")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-group-commit', daemon=True)
+                self._thread.start()
+            self._queue.put((op, args, future))
+        return future
+    
+    def close(self):
+        """Записать оставшиеся операции и остановить поток"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+    
+    def stats(self):
+        """Статистика: число пачек, операций и средний размер пачки"""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'operations': self.operations,
+                'avg_batch': self.operations / self.batches if self.batches else 0.0,
+                'max_batch': self.max_batch_seen
+            }
+    
+    def _collect(self, first):
+        """Собрать пачку: первая операция, уже ожидающие в очереди и пришедшие за max_delay секунд"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stopping = self._collect(item)
+            self._commit(batch)
+    
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.database.transaction() as cursor:
+                for op, args, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    cursor.execute('SAVEPOINT group_op')
+                    try:
+                        result = op(cursor, *args)
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO group_op')
+                        cursor.execute('RELEASE group_op')
+                        results.append((future, None, e))
+                    else:
+                        cursor.execute('RELEASE group_op')
+                        results.append((future, result, None))
+        except Exception as e:
+            logger.error(f"Ошибка групповой записи ({len(batch)} операций): {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        with self._lock:
+            self.batches += 1
+            self.operations += len(results)
+            self.max_batch_seen = max(self.max_batch_seen, len(results))
+        # Результаты отдаются только после COMMIT
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,305 @@
+"""Сквозной нагрузочный тест бота на локальной замене Bot API (fake_bot_api.py).
+
+Запускает bot.py отдельным процессом с временной базой, имитирует тысячи пациентов,
+задающих вопросы, и нескольких врачей, отвечающих на часть вопросов. В конце печатает
+пропускную способность (обновлений/сек), задержку обработки p50/p99 и число вызовов API
+на один вопрос.
+
+    python load_test.py --patients 2000 --doctors 5 --rate 200
+    python load_test.py --latency-ms 50 --rate-limit-prob 0.02 --bot-env OUTBOUND_GLOBAL_RATE=1000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+from database import Database
+from fake_bot_api import FakeBotAPI, SEND_METHODS
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PATIENT_ID_BASE = 1_000_000
+DOCTOR_ID_BASE = 900_000
+
+# Признаки сообщений бота: копия вопроса врачу и ответ врача пациенту
+QUESTION_MARKER = "ID savol:"
+ANSWER_MARKER = "Javob shifokordan"
+QUESTION_ID_RE = re.compile(r"ID savol:\s*(\d+)")
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.doctor_ids = [DOCTOR_ID_BASE + i for i in range(args.doctors)]
+        self.api = FakeBotAPI(
+            port=args.api_port,
+            latency=args.latency_ms / 1000,
+            rate_limit_prob=args.rate_limit_prob,
+            on_call=self.on_call,
+            on_updates=self.on_updates
+        )
+        self._lock = threading.Lock()
+        self._pending = defaultdict(deque)  # chat_id -> update_id, ожидающие ответа бота
+        self._injected_at = {}
+        self._delivered_at = {}
+        self._inbox = deque()  # копии вопросов у врачей: (doctor_id, message_id, text)
+        self._decided = set()  # вопросы, по которым уже решено, отвечать ли
+        self.handler_latencies = []
+        self.e2e_latencies = []
+        self.injected = 0
+        self.acked = 0
+        self.questions = 0
+        self.replies = 0
+        self.answers_delivered = 0
+        self.last_ack_at = None
+    
+    # --- обратные вызовы сервера (поток сервера) ---
+    
+    def on_updates(self, updates):
+        now = time.monotonic()
+        with self._lock:
+            for update in updates:
+                self._delivered_at.setdefault(update['update_id'], now)
+    
+    def on_call(self, method, params, result):
+        if method not in SEND_METHODS:
+            return
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return
+        text = str(params.get('text') or params.get('caption') or '')
+        now = time.monotonic()
+        with self._lock:
+            if chat_id in self.doctor_ids and QUESTION_MARKER in text:
+                self._inbox.append((chat_id, result['message_id'], text))
+            elif ANSWER_MARKER in text:
+                self.answers_delivered += 1
+            elif self._pending[chat_id]:
+                # Первое сообщение бота в чат после обновления - ответ на него (обновления
+                # одного пользователя обрабатываются по порядку)
+                update_id = self._pending[chat_id].popleft()
+                self.acked += 1
+                self.last_ack_at = now
+                self.e2e_latencies.append(now - self._injected_at.pop(update_id))
+                delivered_at = self._delivered_at.pop(update_id, None)
+                if delivered_at is not None:
+                    self.handler_latencies.append(now - delivered_at)
+    
+    # --- имитация пользователей ---
+    
+    def _inject(self, chat_id, message):
+        message_id = self.api.next_message_id()
+        message = dict(message, message_id=message_id, date=int(time.time()))
+        with self._lock:
+            update_id = self.api.push_update({'message': message})
+            self._injected_at[update_id] = time.monotonic()
+            self._pending[chat_id].append(update_id)
+            self.injected += 1
+    
+    def send_question(self, patient_index, number):
+        user_id = PATIENT_ID_BASE + patient_index
+        user = {'id': user_id, 'is_bot': False, 'first_name': 'Bemor', 'last_name': str(patient_index)}
+        self._inject(user_id, {
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Bemor'},
+            'from': user,
+            'text': f"Savol {number}: boshim og'riyapti, nima qilishim kerak?"
+        })
+        self.questions += 1
+    
+    def send_doctor_replies(self):
+        """Ответить на накопившиеся копии вопросов (на каждый вопрос - не больше одного врача)"""
+        while True:
+            with self._lock:
+                if not self._inbox:
+                    return
+                doctor_id, message_id, text = self._inbox.popleft()
+                match = QUESTION_ID_RE.search(text)
+                if not match or match.group(1) in self._decided:
+                    continue
+                self._decided.add(match.group(1))
+            if random.random() >= self.args.answer_ratio:
+                continue
+            self._inject(doctor_id, {
+                'chat': {'id': doctor_id, 'type': 'private', 'first_name': 'Shifokor'},
+                'from': {'id': doctor_id, 'is_bot': False, 'first_name': 'Shifokor', 'last_name': str(doctor_id)},
+                'text': "Ko'proq suv iching va dam oling. Agar og'riq davom etsa, klinikaga keling.",
+                'reply_to_message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': doctor_id, 'type': 'private'},
+                    'text': text
+                }
+            })
+            self.replies += 1
+    
+    def _outstanding(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._pending.values()), len(self._inbox)
+    
+    # --- запуск ---
+    
+    def start_bot(self, workdir):
+        db_file = os.path.join(workdir, 'load_test.db')
+        database = Database(db_file)
+        for doctor_id in self.doctor_ids:
+            database.add_doctor(doctor_id, f"doctor{doctor_id}", f"Shifokor {doctor_id}")
+        database.close()
+        
+        env = dict(os.environ)
+        env.update({
+            'BOT_TOKEN': '123456:LOAD-TEST',
+            'BOT_MODE': 'polling',
+            'BOT_API_BASE_URL': self.api.base_url,
+            'DATABASE_FILE': db_file,
+            'CHANNEL_ID': '@load_test_channel',
+            'TTS_ENABLED': '0',
+            'TTS_CACHE_DIR': os.path.join(workdir, 'tts_cache'),
+        })
+        for item in self.args.bot_env:
+            name, _, value = item.partition('=')
+            env[name] = value
+        self.bot_log_path = os.path.join(workdir, 'bot.log')
+        self.bot_log = open(self.bot_log_path, 'w')
+        return subprocess.Popen(
+            [sys.executable, os.path.join(BOT_DIR, 'bot.py')],
+            cwd=workdir, env=env, stdout=self.bot_log, stderr=subprocess.STDOUT
+        )
+    
+    def run(self):
+        args = self.args
+        self.api.start()
+        with tempfile.TemporaryDirectory(prefix='medicalbot-load-') as workdir:
+            bot = self.start_bot(workdir)
+            try:
+                if not self.api.ready.wait(args.startup_timeout):
+                    raise RuntimeError(f"Бот не начал получать обновления за {args.startup_timeout} сек")
+                report = self._drive()
+            finally:
+                if bot.poll() is None:
+                    bot.send_signal(signal.SIGINT)
+                    try:
+                        bot.wait(30)
+                    except subprocess.TimeoutExpired:
+                        bot.kill()
+                self.bot_log.close()
+                self.api.stop()
+                if args.bot_log:
+                    shutil.copyfile(self.bot_log_path, args.bot_log)
+                if bot.returncode not in (0, -signal.SIGINT):
+                    with open(self.bot_log_path) as f:
+                        print(f.read()[-4000:], file=sys.stderr)
+        return report
+    
+    def _drive(self):
+        args = self.args
+        total = args.patients * args.questions_per_patient
+        interval = 1.0 / args.rate if args.rate > 0 else 0.0
+        started_at = time.monotonic()
+        
+        for i in range(total):
+            self.send_question(i % args.patients, i // args.patients + 1)
+            self.send_doctor_replies()
+            if interval:
+                delay = started_at + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        
+        # Ждем ответов бота на все обновления, продолжая отвечать за врачей
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            self.send_doctor_replies()
+            pending, inbox = self._outstanding()
+            if not pending and not inbox:
+                break
+            time.sleep(0.05)
+        
+        pending, _ = self._outstanding()
+        finished_at = self.last_ack_at or time.monotonic()
+        duration = max(finished_at - started_at, 1e-9)
+        api_stats = self.api.stats()
+        api_calls = api_stats['total_calls'] - api_stats['calls'].get('getUpdates', 0)
+        
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+        
+        return {
+            'patients': args.patients,
+            'doctors': args.doctors,
+            'questions': self.questions,
+            'doctor_replies': self.replies,
+            'answers_delivered': self.answers_delivered,
+            'updates_injected': self.injected,
+            'updates_handled': self.acked,
+            'updates_unanswered': pending,
+            'duration_s': round(duration, 3),
+            'updates_per_s': round(self.acked / duration, 1),
+            'handler_latency_ms': {
+                'p50': ms(percentile(self.handler_latencies, 50)),
+                'p99': ms(percentile(self.handler_latencies, 99)),
+                'max': ms(max(self.handler_latencies, default=None))
+            },
+            'end_to_end_latency_ms': {
+                'p50': ms(percentile(self.e2e_latencies, 50)),
+                'p99': ms(percentile(self.e2e_latencies, 99))
+            },
+            'api_calls': api_calls,
+            'api_calls_per_question': round(api_calls / self.questions, 2) if self.questions else None,
+            'api_calls_by_method': api_stats['calls'],
+            'rate_limited': api_stats['rate_limited'],
+            'settings': {
+                'rate': args.rate,
+                'latency_ms': args.latency_ms,
+                'rate_limit_prob': args.rate_limit_prob,
+                'answer_ratio': args.answer_ratio,
+                'bot_env': args.bot_env
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальной замене Bot API")
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--questions-per-patient', type=int, default=1)
+    parser.add_argument('--doctors', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=200, help="вопросов в секунду (0 - без ограничения)")
+    parser.add_argument('--answer-ratio', type=float, default=0.5, help="доля вопросов, на которые отвечают врачи")
+    parser.add_argument('--latency-ms', type=float, default=20, help="задержка ответа Bot API")
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument('--api-port', type=int, default=0, help="порт fake Bot API (0 - любой свободный)")
+    parser.add_argument('--bot-env', action='append', default=[], metavar='NAME=VALUE',
+                        help="дополнительные переменные окружения для bot.py")
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--timeout', type=float, default=300, help="сколько ждать ответов после отправки всех вопросов")
+    parser.add_argument('--output', help="сохранить результаты в JSON-файл")
+    parser.add_argument('--bot-log', help="сохранить лог bot.py в файл")
+    args = parser.parse_args()
+    
+    report = LoadTest(args).run()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report['updates_unanswered'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram объединяет в альбом не больше 10 файлов
+MAX_GROUP_SIZE = 10
+
+
+class MediaGroupBuffer:
+    """Сборка альбомов (media_group_id) из отдельных обновлений.
+    
+    Каждый файл альбома приходит отдельным обновлением. Сообщения с одним media_group_id
+    накапливаются, пока новые не перестанут приходить window секунд (но не дольше max_wait
+    с первого сообщения или до 10 файлов), после чего callback(messages) вызывается один раз
+    для всего альбома. Обработчик обновления при этом не ждет - ожидание идет в отдельной задаче.
+    """
+    
+    def __init__(self, window=1.0, max_wait=5.0):
+        self.window = window
+        self.max_wait = max_wait
+        self.groups = 0
+        self.messages = 0
+        self._pending = {}  # (chat_id, media_group_id) -> альбом
+        self._tasks = set()
+    
+    def add(self, message, callback):
+        """Добавить сообщение альбома. callback первого сообщения вызывается для всего альбома."""
+        key = (message.chat_id, message.media_group_id)
+        group = self._pending.get(key)
+        if group is None:
+            now = time.monotonic()
+            group = self._pending[key] = {
+                'messages': [], 'callback': callback, 'started_at': now, 'last_at': now, 'full': asyncio.Event()
+            }
+            task = group['task'] = asyncio.create_task(
+                self._flush_later(key, group), name=f"media_group_{message.media_group_id}"
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        group['messages'].append(message)
+        group['last_at'] = time.monotonic()
+        self.messages += 1
+        if len(group['messages']) >= MAX_GROUP_SIZE:
+            group['full'].set()
+    
+    async def _flush_later(self, key, group):
+        while not group['full'].is_set():
+            deadline = min(group['last_at'] + self.window, group['started_at'] + self.max_wait)
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(group['full'].wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        await self._flush(key, group)
+    
+    async def _flush(self, key, group):
+        if self._pending.get(key) is not group:
+            return
+        del self._pending[key]
+        self.groups += 1
+        messages = sorted(group['messages'], key=lambda message: message.message_id)
+        try:
+            await group['callback'](messages)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке альбома {key[1]} из чата {key[0]}: {e}", exc_info=e)
+    
+    async def flush_all(self):
+        """Обработать все накопленные альбомы сразу, не дожидаясь окна (при остановке бота)"""
+        pending = list(self._pending.items())
+        for _, group in pending:
+            group['task'].cancel()
+        # Альбомы, которые уже обрабатываются, дорабатывают сами
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for key, group in pending:
+            await self._flush(key, group)
+    
+    def stats(self):
+        """Статистика буфера альбомов"""
+        return {
+            'pending': len(self._pending),
+            'groups': self.groups,
+            'messages': self.messages
+        }
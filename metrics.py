@@ -0,0 +1,280 @@
+import functools
+import logging
+import threading
+import time
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержки (сек)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Базовый класс метрики с метками"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+    
+    def _render_items(self, items):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+    
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение. Можно задать функцию, которая вычисляет значения при каждом запросе."""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name, documentation, labels=(), callback=None):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+    
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    
+    def render(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+                values = {}
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self._lock:
+                self._values = {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+        return super().render()
+
+
+class CallbackCounter(Gauge):
+    """Счетчик, значения которого берутся из уже существующей статистики (stats())"""
+    
+    kind = 'counter'
+
+
+class Histogram(Metric):
+    """Гистограмма с накопительными корзинами (как в Prometheus)"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+    
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+    
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self.register(Gauge(name, documentation, labels, callback))
+    
+    def callback_counter(self, name, documentation, callback, labels=()):
+        return self.register(CallbackCounter(name, documentation, labels, callback))
+    
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+    
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.histogram(
+    'bot_handler_duration_seconds', "Время выполнения обработчика обновления", ('handler',)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total', "Исключения в обработчиках обновлений", ('handler',)
+)
+API_DURATION = REGISTRY.histogram(
+    'telegram_api_request_duration_seconds', "Время запроса к Telegram Bot API", ('method',)
+)
+API_ERRORS = REGISTRY.counter(
+    'telegram_api_errors_total', "Ошибки запросов к Telegram Bot API (HTTP-код или тип исключения)", ('method', 'error')
+)
+DB_DURATION = REGISTRY.histogram(
+    'db_call_duration_seconds', "Время вызова метода Database, включая ожидание потока",
+    ('method',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+DB_ERRORS = REGISTRY.counter(
+    'db_call_errors_total', "Исключения в методах Database", ('method',)
+)
+TTS_DURATION = REGISTRY.histogram(
+    'tts_synthesis_duration_seconds', "Время получения MP3 для голосового ответа (кэш или синтез)"
+)
+QUESTIONS_RECEIVED = REGISTRY.counter(
+    'bot_questions_received_total', "Вопросов получено от пациентов"
+)
+QUESTIONS_ANSWERED = REGISTRY.counter(
+    'bot_questions_answered_total', "Ответов врачей доставлено пациентам"
+)
+
+
+def observe_handler(callback):
+    """Обертка обработчика PTB: время выполнения, ошибки и интервал в трассе обновления"""
+    name = callback.__name__
+    
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started_at = time.perf_counter()
+        try:
+            with tracing.span('handler', name):
+                return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started_at, handler=name)
+    
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Обернуть все зарегистрированные обработчики application"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = observe_handler(handler.callback)
+
+
+def observe_db_call(method, seconds, error=None):
+    """Наблюдатель для AsyncDatabase: время и ошибки вызовов"""
+    DB_DURATION.observe(seconds, method=method)
+    if error is not None:
+        DB_ERRORS.inc(method=method)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, записывающий время и ошибки каждого метода Bot API"""
+    
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started_at = time.perf_counter()
+        try:
+            with tracing.span('telegram', api_method):
+                status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(method=api_method, error=type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started_at, method=api_method)
+        if status >= 400:
+            API_ERRORS.inc(method=api_method, error=str(status))
+        return status, payload
+
+
+class MetricsServer:
+    """HTTP-сервер с эндпоинтом /metrics в процессе бота"""
+    
+    def __init__(self, host='0.0.0.0', port=9100, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+    
+    async def _handle(self, request):
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
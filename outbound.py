@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты очереди исходящих сообщений (меньше - важнее)
+PRIORITY_ANSWER = 0        # ответы врачей пациентам
+PRIORITY_QUESTION = 1      # рассылка вопросов врачам
+PRIORITY_NORMAL = 2        # подтверждения и служебные сообщения
+
+PRIORITY_NAMES = {
+    PRIORITY_ANSWER: 'answer',
+    PRIORITY_QUESTION: 'question',
+    PRIORITY_NORMAL: 'normal',
+}
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более capacity накопленных токенов"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return now
+    
+    def available(self):
+        """Сколько токенов доступно сейчас (0, пока корзина заблокирована)"""
+        now = self._refill()
+        return 0.0 if self.blocked_until > now else max(0.0, self.tokens)
+    
+    def delay(self, count=1):
+        """Через сколько секунд будет доступно count токенов (без их списания)"""
+        now = self._refill()
+        wait = (count - self.tokens) / self.rate if self.tokens < count else 0.0
+        return max(wait, self.blocked_until - now, 0.0)
+    
+    def take(self):
+        """Списать токен (после того как delay() вернул 0)"""
+        self._refill()
+        self.tokens -= 1
+    
+    def reserve(self):
+        """Забрать токен и вернуть, сколько секунд нужно подождать перед отправкой"""
+        now = self._refill()
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+    
+    def block(self, seconds):
+        """Запретить отправку на указанное время (после RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+    
+    def is_idle(self):
+        """Корзина полная и не заблокирована - ее можно удалить без потери состояния"""
+        now = time.monotonic()
+        tokens = self.tokens + (now - self.updated_at) * self.rate
+        return tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundScheduler:
+    """Очередь исходящих запросов к Telegram с учетом лимитов.
+    
+    Общий token bucket ограничивает суммарную скорость (~30 сообщений/сек), отдельные
+    корзины - скорость в каждый чат. Задачи с меньшим приоритетом отправляются раньше, но
+    каждая ступень приоритета стоит лишь priority_aging секунд ожидания: подтверждение,
+    которое ждет дольше, обгоняет более важные задачи и не голодает под потоком ответов.
+    
+    Обработчик не ждет лимита чата: если корзина чата пуста, задача откладывается в очередь
+    этого чата и возвращается в общую очередь по таймеру, а обработчик тем временем отправляет
+    сообщения в другие чаты. Общий токен берется только непосредственно перед отправкой.
+    При RetryAfter задача возвращается в очередь и повторяется через retry_after секунд.
+    """
+    
+    def __init__(self, global_rate=30.0, per_chat_rate=1.0, per_chat_burst=3, workers=8, max_retries=3,
+                 priority_aging=2.0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.priority_aging = priority_aging
+        
+        self._chat_buckets = {}
+        self._parked = {}  # chat_id -> куча отложенных задач чата, ждущих токен корзины
+        self._timers = {}  # chat_id -> таймер возврата отложенных задач в общую очередь
+        self._retries = {}  # id задачи -> (таймер повтора после RetryAfter, задача, ошибка)
+        self._queue = None
+        self._tasks = []
+        self._counter = itertools.count()
+        self._pending = {priority: 0 for priority in PRIORITY_NAMES}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+    
+    @property
+    def running(self):
+        return bool(self._tasks)
+    
+    async def start(self):
+        """Запустить обработчики очереди"""
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'outbound-{i}')
+            for i in range(self.workers)
+        ]
+        logger.info(f"Очередь исходящих сообщений запущена ({self.workers} обработчиков)")
+    
+    async def stop(self):
+        """Остановить обработчики; неотправленные задачи завершаются с CancelledError, а ждущие повтора - с RetryAfter"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        # Задачи, ждущие повтора после RetryAfter, завершаются последней ошибкой
+        retries, self._retries = self._retries, {}
+        for timer, job, error in retries.values():
+            timer.cancel()
+            self.failed += 1
+            if not job['future'].done():
+                job['future'].set_exception(error)
+        parked, self._parked = self._parked, {}
+        jobs = [job for heap in parked.values() for _, _, job in heap]
+        while self._queue is not None and not self._queue.empty():
+            jobs.append(self._queue.get_nowait()[2])
+        for job in jobs:
+            self._pending[job['priority']] -= 1
+            if not job['future'].done():
+                job['future'].cancel()
+        logger.info(f"Очередь исходящих сообщений остановлена: {self.stats()}")
+    
+    async def send(self, chat_id, request, priority=PRIORITY_NORMAL):
+        """Поставить запрос в очередь и дождаться результата.
+        
+        request - функция без аргументов, возвращающая корутину запроса к API
+        (вызывается заново при каждой попытке).
+        """
+        if not self.running:
+            return await request()
+        
+        future = asyncio.get_running_loop().create_future()
+        job = {
+            'chat_id': chat_id, 'request': request, 'priority': priority, 'attempt': 0, 'future': future,
+            'trace': tracing.current(), 'enqueued_at': time.monotonic()
+        }
+        self._put(job)
+        # Интервал включает ожидание в очереди и лимитов, запрос к API - вложенный интервал
+        with tracing.span('outbound', PRIORITY_NAMES[priority], chat_id=chat_id):
+            return await future
+    
+    def stats(self):
+        """Метрики очереди: глубина по приоритетам и счетчики отправок"""
+        return {
+            'queue_depth': {PRIORITY_NAMES[p]: count for p, count in self._pending.items()},
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'chat_buckets': len(self._chat_buckets),
+            'parked_chats': len(self._parked),
+        }
+    
+    def _put(self, job):
+        """Новая задача (или повтор после RetryAfter)"""
+        self._pending[job['priority']] += 1
+        # Срок с учетом приоритета: чем дольше задача ждет, тем раньше она пойдет
+        item = (job['enqueued_at'] + job['priority'] * self.priority_aging, next(self._counter), job)
+        heap = self._parked.get(job['chat_id'])
+        if heap is not None:
+            # У чата уже есть отложенные задачи - встаем за ними, чтобы не нарушать порядок
+            heapq.heappush(heap, item)
+        else:
+            self._queue.put_nowait(item)
+    
+    def _park(self, item, delay):
+        """Отложить задачу до появления токена в корзине ее чата"""
+        chat_id = item[2]['chat_id']
+        heapq.heappush(self._parked.setdefault(chat_id, []), item)
+        if chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._unpark, chat_id)
+    
+    def _retry(self, job):
+        """Вернуть задачу в очередь после паузы RetryAfter"""
+        self._retries.pop(id(job), None)
+        self._put(job)
+    
+    def _unpark(self, chat_id):
+        """Вернуть в общую очередь столько отложенных задач чата, сколько у него токенов"""
+        self._timers.pop(chat_id, None)
+        heap = self._parked.get(chat_id)
+        if not heap:
+            self._parked.pop(chat_id, None)
+            return
+        bucket = self._chat_bucket(chat_id)
+        count = min(len(heap), max(1, int(bucket.available())))
+        for _ in range(count):
+            self._queue.put_nowait(heapq.heappop(heap))
+        if heap:
+            delay = max(bucket.delay(count + 1), 1 / self.per_chat_rate / 10)
+            self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._unpark, chat_id)
+        else:
+            del self._parked[chat_id]
+    
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_idle()
+                }
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+    
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            job = item[2]
+            if job['future'].done():
+                self._pending[job['priority']] -= 1
+                continue
+            
+            # Чат исчерпал лимит - откладываем задачу и берем следующую
+            chat_bucket = self._chat_bucket(job['chat_id'])
+            delay = chat_bucket.delay()
+            if delay > 0:
+                self._park(item, delay)
+                continue
+            chat_bucket.take()
+            self._pending[job['priority']] -= 1
+            
+            # Общий лимит одинаков для всех задач, поэтому его ожидание никого не обгоняет
+            wait = self.global_bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            
+            try:
+                # Запрос выполняется в трассе обновления, которое его поставило
+                with tracing.activate(job['trace']):
+                    result = await job['request']()
+            except asyncio.CancelledError:
+                if not job['future'].done():
+                    job['future'].cancel()
+                raise
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                chat_bucket.block(retry_after)
+                job['attempt'] += 1
+                if job['attempt'] > self.max_retries:
+                    self.failed += 1
+                    if not job['future'].done():
+                        job['future'].set_exception(e)
+                    continue
+                self.retried += 1
+                logger.warning(f"RetryAfter для чата {job['chat_id']}: повтор через {retry_after} сек")
+                # Возвращаем задачу в очередь позже, не занимая обработчик ожиданием
+                timer = asyncio.get_running_loop().call_later(retry_after, self._retry, job)
+                self._retries[id(job)] = (timer, job, e)
+            except Exception as e:
+                self.failed += 1
+                if not job['future'].done():
+                    job['future'].set_exception(e)
+            else:
+                self.sent += 1
+                if not job['future'].done():
+                    job['future'].set_result(result)
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(data):
+    """Короткий хэш pickle для проверки изменений (сами данные в памяти не храним)"""
+    return hashlib.blake2b(data, digest_size=16).digest() if data is not None else None
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data, chat_data и bot_data в таблице persistent_data базы бота.
+    
+    В отличие от PicklePersistence, при сохранении записывается только строка изменившегося
+    пользователя или чата, и только если ее содержимое действительно изменилось. Данные
+    пользователя/чата загружаются лениво - при первом обновлении от него (refresh_*_data),
+    а не все сразу при старте.
+    """
+    
+    def __init__(self, database, update_interval=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.database = database
+        self._written = {}  # (kind, key) -> хэш последнего записанного/прочитанного pickle
+    
+    async def _load(self, kind, key):
+        """Прочитать данные из базы (один раз на пользователя/чат) или None"""
+        if (kind, key) in self._written:
+            return None
+        data = await self.database.get_persistent_data(kind, key)
+        # Пока шло чтение, данные могли загрузить в другом обработчике
+        if (kind, key) in self._written:
+            return None
+        self._written[(kind, key)] = _digest(data)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать сохраненные данные {kind} {key}: {e}")
+            return None
+    
+    async def _save(self, kind, key, value):
+        """Записать данные, если они изменились с последней записи"""
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить данные {kind} {key}: {e}")
+            return
+        digest = _digest(data)
+        if self._written.get((kind, key)) == digest:
+            return
+        await self.database.set_persistent_data(kind, key, data)
+        self._written[(kind, key)] = digest
+    
+    async def _drop(self, kind, key):
+        await self.database.delete_persistent_data(kind, key)
+        self._written[(kind, key)] = None
+    
+    async def get_user_data(self):
+        # Данные пользователей загружаются лениво в refresh_user_data
+        return {}
+    
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return await self._load('bot', 0) or {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def get_conversations(self, name):
+        return {}
+    
+    async def update_conversation(self, name, key, new_state):
+        pass
+    
+    async def update_user_data(self, user_id, data):
+        # Если строка еще не загружалась, сначала подмешиваем ее, чтобы не затереть сохраненное
+        await self.refresh_user_data(user_id, data)
+        await self._save('user', user_id, data)
+    
+    async def update_chat_data(self, chat_id, data):
+        await self.refresh_chat_data(chat_id, data)
+        await self._save('chat', chat_id, data)
+    
+    async def update_bot_data(self, data):
+        await self._save('bot', 0, data)
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def drop_user_data(self, user_id):
+        await self._drop('user', user_id)
+    
+    async def drop_chat_data(self, chat_id):
+        await self._drop('chat', chat_id)
+    
+    async def refresh_user_data(self, user_id, user_data):
+        stored = await self._load('user', user_id)
+        if stored:
+            # Значения, уже выставленные в памяти, новее сохраненных
+            for name, value in stored.items():
+                user_data.setdefault(name, value)
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        stored = await self._load('chat', chat_id)
+        if stored:
+            for name, value in stored.items():
+                chat_data.setdefault(name, value)
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+    
+    async def flush(self):
+        # Все изменения уже записаны в update_*_data
+        pass
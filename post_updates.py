@@ -0,0 +1,64 @@
+"""Отправка записанных обновлений Telegram на локальный webhook-сервер бота.
+
+Файл может содержать одно обновление, список обновлений, ответ getUpdates
+({"ok": true, "result": [...]}) или обновления по одному в строке (JSON Lines).
+
+    python post_updates.py updates.json
+    python post_updates.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret my_secret
+"""
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+import config
+from webhook import SECRET_HEADER
+
+
+def load_updates(path):
+    """Прочитать обновления из файла"""
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    if isinstance(data, dict) and 'result' in data:
+        data = data['result']
+    return data if isinstance(data, list) else [data]
+
+
+def post_update(url, secret, update):
+    """Отправить одно обновление, вернуть HTTP-статус"""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на webhook-сервер бота")
+    parser.add_argument('path', help="JSON-файл с обновлениями")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=config.WEBHOOK_SECRET_TOKEN)
+    args = parser.parse_args()
+    
+    failed = 0
+    for update in load_updates(args.path):
+        status = post_update(args.url, args.secret, update)
+        print(f"update_id={update.get('update_id')}: HTTP {status}")
+        if status != 200:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import tracemalloc
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingBusy(Exception):
+    """Профилирование уже запущено"""
+
+
+_running = False
+
+
+async def capture(seconds, top=40, memory=True):
+    """Профиль работающего процесса за seconds секунд. Возвращает текстовый отчет.
+    
+    cProfile собирает время функций (в Python 3.12+ - во всех потоках, включая потоки базы и
+    синтеза речи), tracemalloc - прирост памяти по строкам кода за то же время. Пока идет
+    замер, бот продолжает обрабатывать обновления, но медленнее.
+    """
+    global _running
+    if _running:
+        raise ProfilingBusy("Профилирование уже запущено")
+    _running = True
+    started_at = datetime.now()
+    memory_started = memory and not tracemalloc.is_tracing()
+    try:
+        if memory_started:
+            tracemalloc.start(10)
+        snapshot_before = tracemalloc.take_snapshot() if memory else None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        snapshot_after = tracemalloc.take_snapshot() if memory else None
+    finally:
+        if memory_started:
+            tracemalloc.stop()
+        _running = False
+    
+    report = io.StringIO()
+    report.write(f"Profil: {started_at:%Y-%m-%d %H:%M:%S}, {seconds} s\n\n")
+    report.write(f"=== cProfile: top {top} (cumulative) ===\n")
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    report.write(f"\n=== cProfile: top {top} (tottime) ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    
+    if snapshot_before is not None:
+        report.write(f"\n=== tracemalloc: top {top} ===\n")
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ]
+        diff = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters), 'lineno')
+        for stat in diff[:top]:
+            report.write(f"{stat}\n")
+    
+    logger.info(f"Профилирование за {seconds} сек завершено")
+    return report.getvalue()
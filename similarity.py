@@ -0,0 +1,163 @@
+import hashlib
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+# Разные варианты апострофа в узбекской латинице приводятся к одному
+APOSTROPHES_RE = re.compile(r"[ʻʼ’‘`´]")
+NON_WORD_RE = re.compile(r"[^\w']+")
+
+# Пустая ячейка подписи и сдвиг для ячеек, заполненных от соседней (значения 64-битные)
+EMPTY_BIN = (1 << 64) - 1
+DENSIFY_OFFSET = 0x9E3779B97F4A7C15
+
+
+def normalize(text):
+    """Текст вопроса без регистра, пунктуации и лишних пробелов"""
+    text = APOSTROPHES_RE.sub("'", text.lower())
+    return NON_WORD_RE.sub(' ', text).strip()
+
+
+def shingles(text, size=4):
+    """Множество символьных n-грамм нормализованного текста (устойчивы к окончаниям слов)"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class SimilarityIndex:
+    """Инкрементальный индекс похожих вопросов (MinHash + LSH).
+    
+    Для каждого вопроса хранится MinHash-подпись его символьных n-грамм. Подпись считается
+    одной перестановкой (one permutation hashing): каждая n-грамма хэшируется один раз и
+    попадает в одну из num_perm ячеек, а пустые ячейки заполняются от соседней непустой.
+    Это в num_perm раз меньше работы, чем отдельная перестановка на каждое значение. Подпись
+    делится на bands полос; вопросы, у которых совпала хотя бы одна полоса, становятся кандидатами, и
+    для них оценивается сходство Жаккара (доля совпавших значений подписи). Так поиск не
+    перебирает весь индекс. В индексе не больше max_size вопросов - самые старые вытесняются.
+    """
+    
+    def __init__(self, num_perm=32, bands=16, threshold=0.4, max_size=20000, shingle_size=4, min_chars=15, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_size = max_size
+        self.shingle_size = shingle_size
+        self.min_chars = min_chars
+        self._key = seed.to_bytes(8, 'little')
+        self._signatures = OrderedDict()  # question_id -> array подписи (от старых к новым)
+        self._buckets = [{} for _ in range(bands)]  # полоса -> хэш полосы -> множество question_id
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.matches = 0
+    
+    def __len__(self):
+        return len(self._signatures)
+    
+    def signature(self, text):
+        """MinHash-подпись текста или None, если текст слишком короткий для сравнения"""
+        text = normalize(text)
+        if len(text) < self.min_chars:
+            return None
+        num_perm = self.num_perm
+        values = [EMPTY_BIN] * num_perm
+        for shingle in shingles(text, self.shingle_size):
+            h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8, key=self._key).digest(), 'little')
+            index, value = h % num_perm, h // num_perm
+            if value < values[index]:
+                values[index] = value
+        if EMPTY_BIN in values:
+            # Пустая ячейка берет значение ближайшей непустой справа (по кругу) со сдвигом
+            # на расстояние до нее - так у похожих текстов совпадают и заполненные ячейки
+            original = values[:]
+            for index in range(num_perm):
+                if original[index] == EMPTY_BIN:
+                    distance = 1
+                    while original[(index + distance) % num_perm] == EMPTY_BIN:
+                        distance += 1
+                    source = original[(index + distance) % num_perm]
+                    values[index] = (source + distance * DENSIFY_OFFSET) & EMPTY_BIN
+        return array('Q', values)
+    
+    def _band_keys(self, signature):
+        return [hash(signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+    
+    def add(self, question_id, text, signature=None):
+        """Добавить вопрос (повторное добавление того же question_id игнорируется)"""
+        if signature is None:
+            signature = self.signature(text)
+        if signature is None:
+            return False
+        keys = self._band_keys(signature)
+        with self._lock:
+            return self._insert(question_id, signature, keys)
+    
+    def add_many(self, items):
+        """Добавить пары (question_id, text) от старых к новым. Возвращает число добавленных.
+        
+        Подписи считаются без блокировки, а в индекс вся пачка вставляется за один захват.
+        """
+        prepared = []
+        for question_id, text in items:
+            signature = self.signature(text)
+            if signature is not None:
+                prepared.append((question_id, signature, self._band_keys(signature)))
+        with self._lock:
+            return sum(1 for item in prepared if self._insert(*item))
+    
+    def _insert(self, question_id, signature, keys):
+        if question_id in self._signatures:
+            return False
+        self._signatures[question_id] = signature
+        for band, key in zip(self._buckets, keys):
+            band.setdefault(key, set()).add(question_id)
+        while len(self._signatures) > self.max_size:
+            self._remove_oldest()
+        return True
+    
+    def _remove_oldest(self):
+        question_id, signature = self._signatures.popitem(last=False)
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = band.get(key)
+            if bucket is not None:
+                bucket.discard(question_id)
+                if not bucket:
+                    del band[key]
+    
+    def query(self, text, limit=3, exclude=None):
+        """Похожие вопросы: список (question_id, сходство) по убыванию сходства"""
+        signature = self.signature(text)
+        if signature is None:
+            return []
+        keys = self._band_keys(signature)
+        with self._lock:
+            self.queries += 1
+            candidates = set()
+            for band, key in zip(self._buckets, keys):
+                candidates.update(band.get(key, ()))
+            candidates.discard(exclude)
+            scored = []
+            for question_id in candidates:
+                other = self._signatures[question_id]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if score >= self.threshold:
+                    scored.append((question_id, score))
+            if scored:
+                self.matches += 1
+        # При равном сходстве - более новый вопрос
+        scored.sort(key=lambda item: (item[1], item[0]), reverse=True)
+        return scored[:limit]
+    
+    def stats(self):
+        """Статистика индекса"""
+        with self._lock:
+            return {
+                'size': len(self._signatures),
+                'buckets': sum(len(band) for band in self._buckets),
+                'queries': self.queries,
+                'matches': self.matches
+            }
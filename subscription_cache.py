@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SubscriptionCache:
+    """LRU-кэш статуса подписки на канал.
+    
+    Положительный результат хранится positive_ttl секунд, отрицательный - negative_ttl
+    (обычно короче, чтобы только что подписавшийся пользователь не ждал долго).
+    """
+    
+    def __init__(self, positive_ttl=300, negative_ttl=30, max_size=10000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # user_id -> (subscribed, expires_at)
+        self._lock = threading.Lock()
+    
+    def get(self, user_id):
+        """Вернуть закэшированный статус или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            subscribed, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return subscribed
+    
+    def set(self, user_id, subscribed):
+        """Сохранить статус подписки пользователя"""
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        with self._lock:
+            self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, user_id):
+        """Удалить запись пользователя из кэша"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+    
+    def clear(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Статистика кэша"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
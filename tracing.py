@@ -0,0 +1,166 @@
+"""Трассировка обработки обновлений.
+
+Для каждого обновления создается Trace, который хранится в contextvar и поэтому доступен во
+всех корутинах обработки этого обновления. В него попадают интервалы (spans): ожидание
+очереди пользователя, обработчики, запросы к Bot API, вызовы базы данных и синтез речи.
+После обработки трасса записывается одной JSON-строкой в журнал трассировки.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Отдельный логгер журнала трассировки (без вывода в основной лог)
+trace_logger = logging.getLogger('trace')
+trace_logger.propagate = False
+
+# Максимум интервалов в одной трассе - защита от обработчиков с тысячами вызовов
+MAX_SPANS = 500
+
+_current = contextvars.ContextVar('trace', default=None)
+
+_enabled = False
+_min_duration = 0.0
+
+
+def configure(log_file, min_duration_ms=0, max_bytes=50 * 1024 * 1024, backup_count=3):
+    """Включить запись трасс в log_file (пустой путь - трассировка выключена).
+    
+    Записываются только обновления, обработка которых заняла не меньше min_duration_ms.
+    """
+    global _enabled, _min_duration
+    if not log_file:
+        _enabled = False
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.handlers = [handler]
+    trace_logger.setLevel(logging.INFO)
+    _enabled = True
+    _min_duration = min_duration_ms / 1000
+    logger.info(f"Трассировка обновлений пишется в {log_file} (от {min_duration_ms} мс)")
+
+
+class Trace:
+    """Интервалы обработки одного обновления"""
+    
+    def __init__(self, update_id, user_id=None, chat_id=None):
+        self.update_id = update_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.started_at = time.perf_counter()
+        self.created_at = datetime.now()
+        self.spans = []
+        self.dropped = 0
+        self.finished = False
+    
+    def add(self, kind, name, start, duration, error=None, **attrs):
+        """Добавить интервал; start и duration - в секундах perf_counter"""
+        if self.finished:
+            return
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        span = {
+            'kind': kind,
+            'name': name,
+            'start_ms': round((start - self.started_at) * 1000, 2),
+            'duration_ms': round(duration * 1000, 2)
+        }
+        if error is not None:
+            span['error'] = error
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+    
+    def to_dict(self, duration):
+        data = {
+            'time': self.created_at.isoformat(timespec='milliseconds'),
+            'update_id': self.update_id,
+            'user_id': self.user_id,
+            'chat_id': self.chat_id,
+            'duration_ms': round(duration * 1000, 2),
+            'spans': sorted(self.spans, key=lambda span: span['start_ms'])
+        }
+        if self.dropped:
+            data['dropped_spans'] = self.dropped
+        return data
+
+
+def current():
+    """Трасса текущего обновления или None"""
+    return _current.get()
+
+
+@contextmanager
+def activate(trace):
+    """Сделать trace текущей (например, в обработчике очереди, выполняющем чужой запрос)"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def update_trace(update):
+    """Трасса на время обработки обновления; по выходу записывается в журнал"""
+    if not _enabled:
+        yield None
+        return
+    user = getattr(update, 'effective_user', None)
+    chat = getattr(update, 'effective_chat', None)
+    trace = Trace(
+        getattr(update, 'update_id', None),
+        user.id if user is not None else None,
+        chat.id if chat is not None else None
+    )
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        trace.finished = True
+        duration = time.perf_counter() - trace.started_at
+        if duration >= _min_duration:
+            try:
+                trace_logger.info(json.dumps(trace.to_dict(duration), ensure_ascii=False, default=str))
+            except Exception as e:
+                logger.warning(f"Не удалось записать трассу обновления {trace.update_id}: {e}")
+
+
+@contextmanager
+def span(kind, name, **attrs):
+    """Интервал в текущей трассе (ничего не делает, если трассы нет)"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add(kind, name, started_at, time.perf_counter() - started_at, error, **attrs)
+
+
+def record(kind, name, seconds, error=None, **attrs):
+    """Добавить уже завершившийся интервал длительностью seconds"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(kind, name, time.perf_counter() - seconds, seconds, error, **attrs)
+
+
+def observe_db_call(method, seconds, error=None):
+    """Наблюдатель для AsyncDatabase: вызовы базы в трассе обновления"""
+    record('db', method, seconds, type(error).__name__ if error is not None else None)
@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# TTS для голосовых ответов врача (узбекский язык)
+try:
+    from gtts import gTTS
+    TTS_AVAILABLE = True
+except ImportError:
+    TTS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Граница предложения: знак конца предложения и пробел или перевод строки
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+
+def cache_key(text: str, lang: str = "uz") -> str:
+    """Ключ кэша: хэш от (язык, текст)"""
+    return hashlib.sha256(f"{lang}\0{text.strip()}".encode("utf-8")).hexdigest()
+
+
+def split_text(text: str, max_chars: int = 500) -> list[str]:
+    """Разбивает текст на части не длиннее max_chars по границам предложений.
+    
+    Слишком длинные предложения дополнительно режутся по пробелам.
+    """
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END_RE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def text_to_speech_sync(text: str, lang: str = "uz") -> bytes | None:
+    """Синхронно преобразует текст в MP3. Возвращает содержимое файла или None."""
+    if not TTS_AVAILABLE or not text or not text.strip():
+        return None
+    text = text.strip()
+    try:
+        tts = gTTS(text=text, lang=lang, slow=False)
+        buffer = io.BytesIO()
+        tts.write_to_fp(buffer)
+        return buffer.getvalue()
+    except Exception as e:
+        logger.error(f"TTS error: {e}")
+        return None
+
+
+class TTSCache:
+    """Дисковый LRU-кэш синтезированных MP3, ограниченный по суммарному размеру.
+    
+    Порядок LRU хранится во времени изменения файлов, поэтому переживает перезапуск.
+    """
+    
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> размер файла
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+    
+    def _load(self):
+        """Восстановить индекс кэша по файлам на диске"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp3"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+    
+    def get(self, key):
+        """Получить MP3 из кэша или None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+    
+    def put(self, key, data):
+        """Сохранить MP3 в кэш (запись через временный файл, чтобы не оставлять обрезанных файлов)"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить TTS в кэш: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+    
+    def _evict(self):
+        """Удалить самые старые записи, пока кэш больше max_bytes"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+    
+    def stats(self):
+        """Статистика кэша"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class TTSQueueFull(Exception):
+    """Очередь синтеза переполнена - новые задачи не принимаются"""
+
+
+class TTSWorkerPool:
+    """Отдельный пул потоков для синтеза речи.
+    
+    Очередь ограничена: если занято workers + max_queue мест, новые задачи сразу
+    отклоняются с TTSQueueFull, а не копятся. Каждая задача ограничена timeout секундами.
+    """
+    
+    def __init__(self, workers=4, max_queue=32, timeout=60.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending = 0  # задачи в очереди и в работе
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+    
+    def _acquire(self, count):
+        with self._lock:
+            if self._closed:
+                raise TTSQueueFull("Пул синтеза остановлен")
+            if self._pending + count > self.workers + self.max_queue:
+                self.rejected += count
+                raise TTSQueueFull(f"Очередь синтеза переполнена ({self._pending} задач)")
+            self._pending += count
+    
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+    
+    def _wrap(self, func):
+        def job(*args):
+            with self._lock:
+                self._running += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+        return job
+    
+    async def _submit(self, func, args):
+        started_at = time.monotonic()
+        try:
+            future = self._executor.submit(self._wrap(func), *args)
+        except RuntimeError:
+            # Пул уже остановлен
+            with self._lock:
+                self._pending -= 1
+            raise TTSQueueFull("Пул синтеза остановлен")
+        # Место в очереди освобождается, только когда поток действительно закончил работу
+        future.add_done_callback(self._release)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        latency = time.monotonic() - started_at
+        with self._lock:
+            self.completed += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+        return result
+    
+    async def run(self, func, *args):
+        """Выполнить func(*args) в пуле"""
+        self._acquire(1)
+        return await self._submit(func, args)
+    
+    async def map(self, func, items, *args):
+        """Выполнить func(item, *args) для всех items параллельно.
+        
+        Места в очереди резервируются сразу для всех задач, поэтому длинный ответ
+        либо принимается целиком, либо сразу отклоняется.
+        """
+        items = list(items)
+        self._acquire(len(items))
+        return await asyncio.gather(*(self._submit(func, (item, *args)) for item in items))
+    
+    def shutdown(self):
+        """Остановить пул: задачи из очереди отменяются, новые не принимаются"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self):
+        """Статистика пула: длина очереди, число задач в работе и задержки"""
+        with self._lock:
+            return {
+                'queue_length': self._pending - self._running,
+                'running': self._running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_latency': self._latency_total / self.completed if self.completed else 0.0,
+                'max_latency': self._latency_max
+            }
+
+
+async def synthesize(text: str, pool: TTSWorkerPool, lang: str = "uz", cache: TTSCache | None = None, chunk_chars: int = 500) -> bytes | None:
+    """MP3 для текста любой длины.
+    
+    Текст делится на части по границам предложений, части синтезируются параллельно
+    в пуле pool, а MP3-потоки склеиваются по порядку (MP3 допускает простую конкатенацию
+    кадров). Время ответа определяется самой длинной частью, а не всем текстом.
+    Если пул переполнен, выбрасывается TTSQueueFull.
+    """
+    if not TTS_AVAILABLE or not text or not text.strip():
+        return None
+    loop = asyncio.get_running_loop()
+    key = cache_key(text, lang)
+    
+    if cache is not None:
+        data = await loop.run_in_executor(None, cache.get, key)
+        if data is not None:
+            return data
+    
+    chunks = split_text(text, chunk_chars)
+    parts = await pool.map(text_to_speech_sync, chunks, lang)
+    if not parts or not all(parts):
+        return None
+    data = b"".join(parts)
+    
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, key, data)
+    return data
@@ -0,0 +1,80 @@
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+import tracing
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+    
+    Обновления разных пользователей обрабатываются одновременно (не более
+    max_concurrent_updates), а обновления одного пользователя - строго по очереди
+    под его блокировкой. Так состояние в context.user_data (например, вход в админ-панель)
+    не меняется двумя обработчиками сразу.
+    
+    Блокировка пользователя берется раньше собственного семафора: слот параллельности занимает
+    только обновление, стоящее первым в очереди своего пользователя. Поэтому пользователь,
+    приславший много обновлений подряд, не задерживает остальных. Все это делается в публичном
+    do_process_update, а семафор PTB в process_update ничего не ограничивает (он бы держал слот,
+    пока обновление ждет блокировку своего пользователя). Настоящий предел - атрибут limit.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        super().__init__(sys.maxsize)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}  # ключ -> [asyncio.Lock, число ожидающих и работающих задач]
+    
+    @staticmethod
+    def _key(update):
+        """Ключ упорядочивания: пользователь, а если его нет - чат"""
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+    
+    async def do_process_update(self, update, coroutine):
+        with tracing.update_trace(update):
+            key = self._key(update)
+            if key is None:
+                await self._process_with_slot(coroutine)
+                return
+            
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                with tracing.span('wait', 'user_lock'):
+                    await entry[0].acquire()
+                try:
+                    await self._process_with_slot(coroutine)
+                finally:
+                    entry[0].release()
+            finally:
+                entry[1] -= 1
+                # Блокировку удаляем, когда у пользователя не осталось обновлений в обработке
+                if entry[1] == 0:
+                    del self._locks[key]
+    
+    async def _process_with_slot(self, coroutine):
+        """Обработка под собственным семафором (ограничение max_concurrent_updates)"""
+        with tracing.span('wait', 'concurrency'):
+            await self._slots.acquire()
+        try:
+            await coroutine
+        finally:
+            self._slots.release()
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
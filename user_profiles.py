@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+
+class UserProfileCache:
+    """LRU-кэш профилей пользователей (username, full_name) с отложенной записью.
+    
+    Изменения профиля, замеченные в любых обновлениях, накапливаются и сбрасываются
+    в базу пачкой (см. take_dirty). Повторные обновления с тем же профилем ничего не пишут.
+    """
+    
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushed = 0
+        self._profiles = OrderedDict()  # user_id -> (username, full_name)
+        self._dirty = {}  # user_id -> (username, full_name), еще не записанные в базу
+        self._lock = threading.Lock()
+    
+    def observe(self, user_id, username, full_name):
+        """Запомнить профиль пользователя. Возвращает True, если профиль изменился."""
+        profile = (username, full_name)
+        with self._lock:
+            if self._profiles.get(user_id) == profile:
+                self._profiles.move_to_end(user_id)
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._profiles[user_id] = profile
+            self._profiles.move_to_end(user_id)
+            self._dirty[user_id] = profile
+            while len(self._profiles) > self.max_size:
+                # Несохраненные изменения остаются в _dirty и не теряются при вытеснении
+                self._profiles.popitem(last=False)
+                self.evictions += 1
+            return True
+    
+    def take_dirty(self):
+        """Забрать накопленные изменения: список (user_id, username, full_name)"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return [(user_id, username, full_name) for user_id, (username, full_name) in dirty.items()]
+    
+    def mark_flushed(self, rows):
+        """Отметить изменения как записанные"""
+        with self._lock:
+            self.flushed += len(rows)
+    
+    def restore_dirty(self, rows):
+        """Вернуть изменения после неудачной записи (более новые изменения не затираются)"""
+        with self._lock:
+            for user_id, username, full_name in rows:
+                self._dirty.setdefault(user_id, (username, full_name))
+    
+    def stats(self):
+        """Статистика кэша"""
+        with self._lock:
+            return {
+                'size': len(self._profiles),
+                'dirty': len(self._dirty),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'flushed': self.flushed
+            }
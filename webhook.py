@@ -0,0 +1,103 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token, указанный в setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def create_webhook_app(application, path, secret_token, max_connections=40):
+    """aiohttp-приложение, принимающее обновления Telegram.
+    
+    Запрос проверяется по секретному токену, обновление кладется в application.update_queue,
+    и сразу возвращается 200 - обработка идет асинхронно, не задерживая ответ Telegram.
+    Одновременно обрабатывается не больше max_connections запросов (на любой путь): остальные
+    ждут в middleware, не читая тело. Число соединений ограничивает сам Telegram по
+    max_connections из setWebhook.
+    """
+    semaphore = asyncio.Semaphore(max_connections)
+    
+    @web.middleware
+    async def limit_requests(request, handler):
+        async with semaphore:
+            return await handler(request)
+    
+    async def handle_update(request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token, secret_token):
+            logger.warning(f"Webhook: запрос с неверным секретным токеном от {request.remote}")
+            return web.Response(status=403)
+        
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.Response(status=400, text='Invalid JSON')
+        try:
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.warning(f"Webhook: не удалось разобрать обновление: {e}")
+            return web.Response(status=400, text='Invalid update')
+        await application.update_queue.put(update)
+        return web.Response(status=200)
+    
+    app = web.Application(middlewares=[limit_requests])
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(application, listen, port, path, secret_token, webhook_url=None, max_connections=40,
+                      allowed_updates=None, drop_pending_updates=True):
+    """Запуск бота в режиме webhook до получения SIGINT/SIGTERM.
+    
+    Повторяет жизненный цикл Application.run_webhook (post_init, post_stop, post_shutdown),
+    но со своим HTTP-сервером. Если webhook_url не задан, setWebhook не вызывается -
+    так сервер можно проверять локально, отправляя ему записанные обновления.
+    """
+    app = create_webhook_app(application, path, secret_token, max_connections)
+    runner = web.AppRunner(app, access_log=None)
+    
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret_token,
+                max_connections=max_connections,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=drop_pending_updates
+            )
+            logger.info(f"Webhook установлен: {webhook_url}")
+        
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(f"Webhook-сервер слушает {listen}:{port}{path}")
+        
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Windows: у цикла событий нет обработчиков сигналов
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(stop_event.set))
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)